@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Compare the XOR autokey cipher backends across payload sizes.
+
+    python3 benchmarks/cipher.py --sizes 100,1024,4096,16384,65536
+"""
+
+from os.path import exists, join, realpath
+import argparse
+import os
+import random
+import sys
+import timeit
+
+rootPath = realpath(join(__file__, os.pardir, os.pardir))
+if exists(join(rootPath, 'tplink')):
+    sys.path.insert(0, rootPath)
+
+from tplink import cipher
+from tplink.devices import Device
+
+
+def Payload(size, seed=0):
+    # JSON-like payloads are mostly printable ASCII which is what the
+    # devices send for large get_daystat/get_monthstat responses.
+    generator = random.Random(seed)
+    alphabet = b'{}[]":,0123456789abcdefghijklmnopqrstuvwxyz_'
+    return bytes(generator.choice(alphabet) for _ in range(size))
+
+
+def Measure(function, data, key, number):
+    return min(timeit.repeat(lambda: function(data, key), number=number, repeat=3)) / number
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1024,4096,16384,65536',
+        help='Comma separated list of payload sizes in bytes')
+    parser.add_argument('--number', type=int, default=200,
+        help='Iterations per measurement')
+    args = parser.parse_args()
+
+    key = Device.ENCRYPTION_KEY
+    sizes = [int(value) for value in args.sizes.split(',')]
+    backends = ['python'] + sorted(name for name in cipher.BACKENDS if name != 'python')
+    print('Selected backend: {}'.format(cipher.GetBackend()))
+    print('{:>8} {:>8} {:>14} {:>14} {:>9}'.format(
+        'size', 'backend', 'encrypt (us)', 'decrypt (us)', 'speedup'))
+
+    for size in sizes:
+        plaintext = Payload(size)
+        reference = cipher.PythonEncrypt(plaintext, key)
+        baseline = None
+        for name in backends:
+            encrypt, decrypt = cipher.BACKENDS[name]
+            ciphertext = encrypt(plaintext, key)
+            if ciphertext != reference or decrypt(ciphertext, key) != plaintext:
+                raise RuntimeError("Backend '{}' output differs at {} bytes".format(name, size))
+            encryptTime = Measure(encrypt, plaintext, key, args.number)
+            decryptTime = Measure(decrypt, ciphertext, key, args.number)
+            if name == 'python':
+                baseline = encryptTime + decryptTime
+            print('{:>8} {:>8} {:>14.1f} {:>14.1f} {:>8.1f}x'.format(
+                size, name, encryptTime * 1e6, decryptTime * 1e6,
+                baseline / (encryptTime + decryptTime) if baseline else 1.0))
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Measure poll cycle time against emulated devices as the fleet grows.
+
+    python3 benchmarks/poll.py --counts 10,50,100,200 --latency 0.05
+"""
+
+from os.path import exists, join, realpath
+import argparse
+import logging
+import os
+import sys
+import time
+
+rootPath = realpath(join(__file__, os.pardir, os.pardir))
+if exists(join(rootPath, 'commands')):
+    sys.path.insert(0, rootPath)
+
+from commands.poll import Poll
+from tplink.emulator import Emulator
+
+
+def BuildConfig(emulators):
+    config = {}
+    for i, emulator in enumerate(emulators):
+        name = 'plug{}'.format(i)
+        config[name] = {
+            'address': emulator.address,
+            'port': emulator.port,
+            'device': name,
+            'measurements': {'emeter': ['current', 'voltage', 'power', 'total']},
+        }
+    return config
+
+
+def Measure(config, concurrency, cycles):
+    os.environ['POLLER_CONCURRENCY'] = str(concurrency)
+    logger = logging.getLogger('benchmark')
+    timings = []
+    for _ in range(cycles):
+        metrics = []
+        start = time.perf_counter()
+        Poll(config, logger, metrics.append)
+        timings.append(time.perf_counter() - start)
+        readings = [metric for metric in metrics if metric.measurement == 'emeter']
+        if len(readings) != len(config):
+            raise RuntimeError('Expected {} metrics, received {}'.format(
+                len(config), len(readings)))
+    return min(timings), sum(timings) / len(timings)
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='1,10,50,100,200',
+        help='Comma separated list of device counts')
+    parser.add_argument('--latency', type=float, default=0.05,
+        help='Emulated device response latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=32,
+        help='Concurrency limit for the parallel run')
+    parser.add_argument('--cycles', type=int, default=3,
+        help='Number of cycles measured per configuration')
+    args = parser.parse_args()
+
+    counts = [int(value) for value in args.counts.split(',')]
+    print('{:>8} {:>14} {:>14} {:>10}'.format(
+        'devices', 'sequential (s)', 'parallel (s)', 'speedup'))
+    for count in counts:
+        emulators = [Emulator(latency=args.latency) for _ in range(count)]
+        for emulator in emulators:
+            emulator.Start()
+        try:
+            config = BuildConfig(emulators)
+            sequential, _ = Measure(config, 1, args.cycles)
+            parallel, _ = Measure(config, args.concurrency, args.cycles)
+        finally:
+            for emulator in emulators:
+                emulator.Stop()
+        print('{:>8} {:>14.3f} {:>14.3f} {:>9.1f}x'.format(
+            count, sequential, parallel, sequential / parallel))
+
+
+if __name__ == '__main__':
+    Main()
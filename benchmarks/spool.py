@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Measure metric spool append and replay throughput for several fsync
+intervals.
+
+    python3 benchmarks/spool.py --count 100000 --sync 0,0.1,1
+"""
+
+from os.path import exists, join, realpath
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+rootPath = realpath(join(__file__, os.pardir, os.pardir))
+if exists(join(rootPath, 'commands')):
+    sys.path.insert(0, rootPath)
+
+from commands.spool import Spool, SpoolingPipeline, Serialize
+from monitor.lib import Metric
+
+
+def BuildMetric(index):
+    metric = Metric('plug{}'.format(index % 100), 'emeter',
+        tags={'device': 'plug{}'.format(index % 100)})
+    metric.AddField('current', 0.512)
+    metric.AddField('voltage', 120.5)
+    metric.AddField('power', 61.0 + index % 10)
+    metric.AddField('total', 13.27)
+    return metric
+
+
+def Measure(count, sync, segmentSize):
+    with tempfile.TemporaryDirectory() as path:
+        spool = Spool(path, segmentSize=segmentSize, maxSize=1 << 40, syncInterval=sync)
+        payloads = [Serialize(BuildMetric(index)) for index in range(count)]
+        start = time.perf_counter()
+        for payload in payloads:
+            spool.Append(payload)
+        spool.Sync()
+        append = time.perf_counter() - start
+        size = spool.Size()
+
+        replayed = []
+        pipeline = SpoolingPipeline(replayed.append, spool, batch=1000)
+        start = time.perf_counter()
+        pipeline.Drain()
+        drain = time.perf_counter() - start
+        spool.Close()
+        if len(replayed) != count:
+            raise RuntimeError('Expected {} replayed metrics, received {}'.format(
+                count, len(replayed)))
+        return append, drain, size
+
+
+def Main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000,
+        help='Number of metrics spooled per run')
+    parser.add_argument('--sync', default='0,0.1,1',
+        help='Comma separated list of fsync intervals in seconds')
+    parser.add_argument('--segment-size', type=int, default=4 * 1024 * 1024,
+        dest='segment_size', help='Segment size in bytes')
+    args = parser.parse_args()
+
+    print('{:>8} {:>16} {:>16} {:>10}'.format(
+        'sync (s)', 'append (rec/s)', 'replay (rec/s)', 'size (MB)'))
+    for sync in [float(value) for value in args.sync.split(',')]:
+        append, drain, size = Measure(args.count, sync, args.segment_size)
+        print('{:>8} {:>16.0f} {:>16.0f} {:>10.1f}'.format(
+            sync, args.count / append, args.count / drain, size / 1e6))
+
+
+if __name__ == '__main__':
+    Main()
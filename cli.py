@@ -28,7 +28,7 @@ if exists(join(parentPath, 'PyMonitorLib')):
 if exists(join(rootPath, 'commands')):
     sys.path.insert(0, rootPath)
 
-from commands import Interactive, Poll, Status
+from commands import Backfill, Control, Discover, Interactive, Poll, Status
 from monitor.lib import Execute
 
 
@@ -41,6 +41,10 @@ def ConfigureParams(parser):
     """
     parser.add_argument('--device', '-d', action='append', dest='devices',
         help='List of known devices. If provided discovery is skipped.')
+    parser.add_argument('--keepalive', action='store_true', default=False,
+        help='Reuse one connection per device for consecutive requests.')
+    parser.add_argument('--registry', default=None,
+        help='Device registry file used to skip type detection on startup.')
     return parser
 
 
@@ -53,10 +57,50 @@ def Setup(args):
     :param args: Callback registration tool.
     :return: None
     """
-    ConfigureParams(args.Register('status', Status,
+    parser = ConfigureParams(args.Register('status', Status,
         help='Status command for polling the state of the configured devices'))
+    parser.add_argument('--history', default=None,
+        help='History file written by the poller (POLLER_HISTORY_FILE) to show recent trends.')
+    parser.add_argument('--table', action='store_true', default=False,
+        help='Print one row per device instead of the detailed report.')
+    parser.add_argument('--json', action='store_true', default=False,
+        help='Print the status of every device as JSON.')
+    parser.add_argument('--concurrency', type=int, default=32,
+        help='Maximum number of devices queried at the same time.')
     ConfigureParams(args.Register('interactive', Interactive,
         help='Run the interactive mode for the CLI tool.'))
+    parser = ConfigureParams(args.Register('backfill', Backfill,
+        help='Export the daily and monthly energy statistics stored on the devices.'))
+    parser.add_argument('--output', '-o', default='-',
+        help='File the line protocol points are appended to. Defaults to stdout.')
+    parser.add_argument('--checkpoint', '-c', default=None,
+        help='Checkpoint file recording exported months so interrupted runs resume.')
+    parser.add_argument('--since', '-s', default=None,
+        help='First month to export as YYYY or YYYY-MM. Defaults to all history.')
+    parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+        help='Number of points written per batch.')
+    parser.add_argument('--concurrency', type=int, default=8,
+        help='Maximum number of devices exported at the same time.')
+    parser = ConfigureParams(args.Register('control', Control,
+        help='Send a command to a group of devices at the same time.'))
+    parser.add_argument('action', choices=('on', 'off', 'toggle', 'brightness', 'reboot'),
+        help='Command sent to every selected device.')
+    parser.add_argument('value', type=int, nargs='?', default=None,
+        help='Brightness between 0 and 100 for the brightness command.')
+    parser.add_argument('--tag', '-t', action='append', dest='tags',
+        help='Only devices configured with this key=value tag. May be repeated.')
+    parser.add_argument('--alias', '-a', default=None,
+        help='Only devices whose alias matches this pattern, for example "kitchen*".')
+    parser.add_argument('--type', default=None,
+        help='Only devices of this type: plug, bulb or lightstrip.')
+    parser.add_argument('--concurrency', type=int, default=32,
+        help='Maximum number of devices commanded at the same time.')
+    parser = args.Register('discover', Discover,
+        help='Discover devices on the local network with a UDP broadcast.')
+    parser.add_argument('--address', '-a', default=None,
+        help='Broadcast address to probe. Defaults to 255.255.255.255.')
+    parser.add_argument('--timeout', '-t', type=float, default=3.0,
+        help='Seconds to wait for replies.')
 
 
 if __name__ == '__main__':
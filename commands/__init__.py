@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .backfill import Backfill
+from .control import Control
+from .discover import Discover
 from .interactive import Interactive
 from .poll import Poll
 from .status import Status
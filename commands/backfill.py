@@ -0,0 +1,262 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from monitor.lib import ConfigError
+from tplink.devices import Device, EmeterHandler
+from tplink.discover import LoadDevice, Registry
+from tplink.exceptions import ConnectionError
+from tplink.pool import ConnectionPool
+from tplink.utils import IsValidIPv4
+from .lineprotocol import FormatLine
+import json
+import os
+import sys
+import threading
+import time
+
+MAX_YEARS = 10
+
+
+class BatchWriter(object):
+    """
+    Collects line protocol points and writes them in batches. Checkpoint
+    marks added with a batch are only recorded once the batch has been
+    written, so an interrupted run never skips unwritten points.
+    """
+
+    def __init__(self, handle, size=500, checkpoint=None):
+        self.handle = handle
+        self.size = max(1, int(size))
+        self.checkpoint = checkpoint
+        self.lines = []
+        self.marks = []
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def Add(self, lines, mark=None):
+        with self.lock:
+            self.lines.extend(lines)
+            if mark is not None:
+                self.marks.append(mark)
+            if len(self.lines) >= self.size:
+                self.__Flush()
+
+    def Flush(self):
+        with self.lock:
+            self.__Flush()
+
+    def __Flush(self):
+        if self.lines:
+            self.handle.write('\n'.join(self.lines) + '\n')
+            self.handle.flush()
+            self.written += len(self.lines)
+            self.lines = []
+        if self.checkpoint is not None and self.marks:
+            for mark in self.marks:
+                self.checkpoint.Mark(*mark)
+            self.checkpoint.Save()
+        self.marks = []
+
+
+class Checkpoint(object):
+    """
+    Record of the months already exported for each device, persisted as a
+    JSON file. Only past months are recorded since the current month is
+    still changing.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.devices = {}
+
+    def IsComplete(self, name, year, month):
+        return '{:04d}-{:02d}'.format(year, month) in self.devices.get(name, ())
+
+    def Load(self):
+        try:
+            with open(self.path, 'r') as handle:
+                data = json.load(handle)
+        except FileNotFoundError:
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return False
+        self.devices = {name: set(months) for name, months in data.get('devices', {}).items()}
+        return True
+
+    def Mark(self, name, year, month):
+        self.devices.setdefault(name, set()).add('{:04d}-{:02d}'.format(year, month))
+
+    def Save(self):
+        data = {
+            'version': self.VERSION,
+            'devices': {name: sorted(months) for name, months in self.devices.items()},
+        }
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary, 'w') as handle:
+            json.dump(data, handle, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+def Backfill(config, args):
+    try:
+        config.Load()
+    except ConfigError as e:
+        print('Failed to load config: {}'.format(e), file=sys.stderr)
+        return False
+
+    since = None
+    if args.since:
+        try:
+            since = ParseMonth(args.since)
+        except ValueError:
+            print('Invalid start month: {}'.format(args.since), file=sys.stderr)
+            return False
+
+    targets = []
+    for [name, cfg] in config.GetRoot().items():
+        tags = {'device': cfg.get('device', name)}
+        tags.update(cfg.get('tags', {}))
+        targets.append((name, cfg['address'], int(cfg.get('port', Device.DEFAULT_PORT)), tags))
+    for address in args.devices or []:
+        if not IsValidIPv4(address):
+            print('Invalid IPv4 Address: {}'.format(address), file=sys.stderr)
+            continue
+        targets.append((address, address, Device.DEFAULT_PORT, {'device': address}))
+    if not targets:
+        print('No devices to backfill', file=sys.stderr)
+        return False
+
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint)
+        checkpoint.Load()
+    registry = None
+    if args.registry:
+        registry = Registry(args.registry)
+        registry.Load()
+
+    # Appending keeps the points of an interrupted run which the checkpoint
+    # already accounts for.
+    handle = sys.stdout if args.output == '-' else open(args.output, 'a')
+    writer = BatchWriter(handle, args.batch_size, checkpoint)
+    pool = ConnectionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(args.concurrency, len(targets))),
+                thread_name_prefix='backfill') as executor:
+            results = list(executor.map(lambda target: BackfillDevice(
+                target, writer, checkpoint=checkpoint, since=since, pool=pool,
+                registry=registry), targets))
+        writer.Flush()
+    finally:
+        pool.Close()
+        if registry is not None:
+            registry.Save()
+        if handle is not sys.stdout:
+            handle.close()
+
+    print('Wrote {} points for {} of {} devices'.format(
+        writer.written, sum(1 for result in results if result), len(targets)), file=sys.stderr)
+    return all(results)
+
+
+def BackfillDevice(target, writer, checkpoint=None, since=None, pool=None, registry=None):
+    """
+    Export the daily and monthly energy statistics stored on a device. Years
+    are walked backwards from the current year until the start month, or
+    until a year without any statistics when no start month is given.
+
+    :param target: Tuple of (name, address, port, tags).
+    :param writer: BatchWriter receiving the points.
+    :param checkpoint: Optional Checkpoint of months already exported.
+    :param since: Optional (year, month) of the first month to export.
+    :param pool: Optional connection pool.
+    :param registry: Optional device registry.
+    :return: True if the statistics were exported.
+    """
+    name, address, port, tags = target
+    try:
+        device = LoadDevice(address, port=port, pool=pool, registry=registry)
+    except ConnectionError as e:
+        print("Failed to connect to '{}': {}".format(name, e.message), file=sys.stderr)
+        return False
+    if device is None or not device.HasEmeter():
+        print("Device '{}' does not support electronic metering".format(name), file=sys.stderr)
+        return False
+
+    emeter = device.GetEmeter()
+    now = datetime.now()
+    current = (now.year, now.month)
+    first = since[0] if since is not None else now.year - MAX_YEARS + 1
+    try:
+        for year in range(now.year, first - 1, -1):
+            months = emeter.GetMonthlyUsage(year, cache=False)
+            if not months and since is None and year < now.year:
+                break
+            for entry in months:
+                month = (int(entry['year']), int(entry['month']))
+                if since is not None and month < since:
+                    continue
+                if checkpoint is not None and checkpoint.IsComplete(name, *month):
+                    continue
+                days = emeter.GetDailyUsage(month[1], month[0], cache=False)
+                writer.Add(FormatPoints(tags, entry, days),
+                    (name,) + month if month < current else None)
+    except ConnectionError as e:
+        print("Failed to read statistics of '{}': {}".format(name, e.message), file=sys.stderr)
+        return False
+    return True
+
+
+def FormatPoints(tags, month, days):
+    """
+    Build the line protocol points of one month: a point per day and one
+    for the month, with the energy normalized to Wh.
+    """
+    lines = []
+    for day in days:
+        energy = EmeterHandler.GetEnergy(day)
+        if energy is None:
+            continue
+        lines.append(FormatLine('energy_daily', tags, {'energy_wh': energy},
+            Timestamp(day['year'], day['month'], day['day'])))
+    energy = EmeterHandler.GetEnergy(month)
+    if energy is not None:
+        lines.append(FormatLine('energy_monthly', tags, {'energy_wh': energy},
+            Timestamp(month['year'], month['month'])))
+    return lines
+
+
+def ParseMonth(value):
+    """
+    :param value: 'YYYY' or 'YYYY-MM'.
+    :return: Tuple of (year, month).
+    """
+    parts = value.split('-')
+    if len(parts) > 2:
+        raise ValueError(value)
+    month = (int(parts[0]), int(parts[1]) if len(parts) == 2 else 1)
+    if not 1 <= month[1] <= 12:
+        raise ValueError(value)
+    return month
+
+
+def Timestamp(year, month, day=1):
+    """
+    :return: Local midnight of the date in nanoseconds since the epoch.
+    """
+    return int(time.mktime((int(year), int(month), int(day), 0, 0, 0, 0, 0, -1))) * 1000000000
@@ -0,0 +1,202 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from monitor.lib import ConversionFailure
+from urllib.request import Request, urlopen
+from .lineprotocol import FormatLine
+import gzip
+import threading
+import time
+
+
+class PartialBatchError(Exception):
+    """
+    Raised by a batch sink which failed after delivering part of a batch.
+    """
+
+    def __init__(self, delivered, error):
+        super(PartialBatchError, self).__init__(str(error))
+        self.delivered = delivered
+        self.error = error
+
+
+class BatchingPipeline(object):
+    """
+    Metric sink wrapper which gathers metrics and hands them to a batch
+    sink once the batch is full or the flush interval has passed. Metrics
+    are stamped with the time they were collected so the batch delay does
+    not shift them.
+    """
+
+    def __init__(self, sink, size=500, interval=1.0, logger=None, clock=time.monotonic):
+        """
+        :param sink: Callable accepting a list of (metric, timestamp) tuples,
+            timestamps in nanoseconds.
+        :param size: Number of metrics which triggers a flush.
+        :param interval: Seconds after which a partial batch is flushed.
+        :param logger: Logger instance.
+        :param clock: Monotonic clock.
+        """
+        self.sink = sink
+        self.size = max(1, int(size))
+        self.interval = float(interval)
+        self.logger = logger
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.pending = []
+        self.started = None
+        self.event = threading.Event()
+        self.thread = None
+        self.stopped = False
+        self.batches = 0
+        self.points = 0
+        self.largest = 0
+        self.dropped = 0
+        self.flushTime = 0.0
+        self.flushTimeMax = 0.0
+
+    def __call__(self, metric):
+        # Spooled metrics carry their collection time in seconds.
+        timestamp = getattr(metric, 'timestamp', None)
+        if isinstance(timestamp, (int, float)):
+            timestamp = int(timestamp * 1e9)
+        else:
+            timestamp = time.time_ns()
+        with self.lock:
+            if not self.pending:
+                self.started = self.clock()
+            self.pending.append((metric, timestamp))
+            full = len(self.pending) >= self.size
+            due = self.clock() - self.started >= self.interval
+        if full or due:
+            self.Flush()
+
+    def Flush(self):
+        """
+        Hand the pending metrics to the sink. The part of a batch the sink
+        fails to accept is dropped and counted.
+
+        :return: Number of metrics flushed.
+        """
+        with self.flushLock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            start = self.clock()
+            try:
+                self.sink(batch)
+            except Exception as e:
+                delivered = e.delivered if isinstance(e, PartialBatchError) else 0
+                self.dropped += len(batch) - delivered
+                self.points += delivered
+                if self.logger:
+                    self.logger.error('Failed to submit {} of {} metrics: {}'.format(
+                        len(batch) - delivered, len(batch), e))
+                return delivered
+            elapsed = self.clock() - start
+            self.batches += 1
+            self.points += len(batch)
+            self.largest = max(self.largest, len(batch))
+            self.flushTime += elapsed
+            self.flushTimeMax = max(self.flushTimeMax, elapsed)
+            return len(batch)
+
+    def Start(self):
+        """
+        Flush partial batches from a background thread every interval.
+        """
+        def Run():
+            while not self.stopped:
+                self.event.wait(self.interval)
+                self.Flush()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=Run, name='batch-flush', daemon=True)
+            self.thread.start()
+
+    def Stats(self):
+        return {
+            'batches': self.batches,
+            'points': self.points,
+            'batch_size_avg': float(self.points) / self.batches if self.batches else 0.0,
+            'batch_size_max': self.largest,
+            'flush_time_avg': self.flushTime / self.batches if self.batches else 0.0,
+            'flush_time_max': self.flushTimeMax,
+            'dropped': self.dropped,
+        }
+
+    def Stop(self):
+        self.stopped = True
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.Flush()
+
+
+class LineProtocolSink(object):
+    """
+    Batch sink which writes the metrics to an InfluxDB write endpoint as a
+    single line protocol request body, optionally gzip compressed.
+    """
+
+    def __init__(self, url, compress=True, timeout=10.0, level=6):
+        """
+        :param url: Write endpoint including the query string, for example
+            http://127.0.0.1:8086/write?db=power&precision=ns
+        :param compress: Compress the body with gzip.
+        :param timeout: Request timeout in seconds.
+        :param level: gzip compression level.
+        """
+        self.url = url
+        self.compress = compress
+        self.timeout = float(timeout)
+        self.level = int(level)
+        self.bytes = 0
+
+    def __call__(self, batch):
+        body = '\n'.join(FormatLine(metric.measurement, metric.tags, metric.fields, timestamp)
+            for metric, timestamp in batch if metric.fields).encode()
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=self.level)
+            headers['Content-Encoding'] = 'gzip'
+        self.bytes += len(body)
+        with urlopen(Request(self.url, data=body, headers=headers, method='POST'),
+                timeout=self.timeout) as response:
+            response.read()
+
+
+class PipelineSink(object):
+    """
+    Batch sink which forwards every metric of a batch to a per-metric
+    pipeline such as the monitor.lib sink. Metrics without a timestamp are
+    given their collection time in seconds, like spooled metrics.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def __call__(self, batch):
+        for index, (metric, timestamp) in enumerate(batch):
+            if getattr(metric, 'timestamp', None) is None:
+                metric.timestamp = timestamp / 1e9
+            try:
+                self.pipeline(metric)
+            except ConversionFailure:
+                pass
+            except Exception as e:
+                raise PartialBatchError(index, e)
@@ -0,0 +1,125 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from monitor.lib import ConfigError
+from tplink.devices import Device
+from tplink.discover import LoadDevice, Registry
+from tplink.exceptions import ConnectionError
+from tplink.group import DeviceGroup
+from tplink.pool import ConnectionPool
+from tplink.utils import IsValidIPv4
+import time
+
+
+def Control(config, args):
+    """
+    Entry point for the control command. Sends one command to every device
+    matching the given tags, alias pattern and type at the same time.
+    """
+    try:
+        config.Load()
+    except ConfigError as e:
+        print('Failed to load config: {}'.format(e))
+        return False
+
+    tags = {}
+    for tag in args.tags or []:
+        key, separator, value = tag.partition('=')
+        if not separator:
+            print('Invalid tag, expected key=value: {}'.format(tag))
+            return False
+        tags[key] = value
+    if args.action == 'brightness' and args.value is None:
+        print('Specify the brightness between 0 and 100')
+        return False
+
+    targets = []
+    for [name, cfg] in config.GetRoot().items():
+        targets.append((name, cfg['address'], int(cfg.get('port', Device.DEFAULT_PORT)),
+            cfg.get('tags', {})))
+    for address in args.devices or []:
+        if not IsValidIPv4(address):
+            print('Invalid IPv4 Address: {}'.format(address))
+            continue
+        targets.append((address, address, Device.DEFAULT_PORT, {}))
+    # Tags come from the configuration, so unmatched devices are never loaded.
+    targets = [target for target in targets
+        if all(target[3].get(key) == value for key, value in tags.items())]
+    if not targets:
+        print('No devices match')
+        return False
+
+    pool = ConnectionPool() if args.keepalive else None
+    registry = None
+    if args.registry:
+        registry = Registry(args.registry)
+        registry.Load()
+    try:
+        return ControlDevices(targets, args, pool=pool, registry=registry)
+    finally:
+        if registry is not None:
+            registry.Save()
+        if pool is not None:
+            pool.Close()
+
+
+def ControlDevices(targets, args, pool=None, registry=None):
+    start = time.perf_counter()
+
+    def Load(target):
+        name, address, port, _ = target
+        try:
+            return LoadDevice(address, port=port, pool=pool, registry=registry)
+        except ConnectionError as e:
+            print("Failed to connect to '{}': {}".format(name, e.message))
+        return None
+
+    concurrency = max(1, args.concurrency)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(targets)),
+            thread_name_prefix='control') as executor:
+        devices = list(executor.map(Load, targets))
+
+    group = DeviceGroup(concurrency)
+    for (name, address, _, tags), device in zip(targets, devices):
+        if device is None:
+            print('Failed to load device: {}'.format(name))
+            continue
+        group.Add(device, name=name, tags=tags)
+    group = group.Select(alias=args.alias, type=args.type)
+    if not len(group):
+        print('No devices match')
+        return False
+
+    if args.action == 'on':
+        results = group.On()
+    elif args.action == 'off':
+        results = group.Off()
+    elif args.action == 'toggle':
+        results = group.Toggle()
+    elif args.action == 'brightness':
+        results = group.SetBrightness(args.value)
+    else:
+        results = group.Reboot()
+
+    for result in results:
+        print('{:<24} {:<16} {:<8} {:>8.1f}ms {}'.format(
+            result.name, result.device.address, 'ok' if result.success else 'FAILED',
+            result.elapsed * 1000, result.error or ''))
+    succeeded = sum(1 for result in results if result.success)
+    print()
+    print("Sent '{}' to {} of {} devices in {:.1f}ms ({:.1f}ms including discovery)".format(
+        args.action, succeeded, len(results), group.elapsed * 1000,
+        (time.perf_counter() - start) * 1000))
+    return succeeded == len(results)
@@ -0,0 +1,74 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import threading
+import time
+
+
+class Scheduler(object):
+    """
+    Fixed-rate scheduler for the daemon mode. Every cycle is due at
+    start + n * interval, so time spent polling does not accumulate as
+    drift. Cycles run one at a time; if a cycle overruns its interval the
+    missed slots are skipped rather than run back to back.
+    """
+
+    def __init__(self, interval, logger=None, clock=time.monotonic):
+        if interval <= 0:
+            raise ValueError('Scheduler interval must be positive')
+        self.interval = float(interval)
+        self.logger = logger
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    def Run(self, callback):
+        """
+        Invoke the callback on schedule until Stop is called.
+
+        :param callback: Callable run once per cycle.
+        :return: None
+        """
+        start = self.clock()
+        slot = 0
+        while not self.stopped.is_set():
+            began = self.clock()
+            callback()
+            self.cycles += 1
+
+            now = self.clock()
+            elapsed = now - began
+            nextSlot = slot + 1
+            if now > start + nextSlot * self.interval:
+                current = int(math.floor((now - start) / self.interval))
+                missed = current - slot
+                self.overruns += 1
+                self.skipped += missed
+                nextSlot = current + 1
+                if self.logger:
+                    self.logger.warning(
+                        'Poll cycle took {:.3f}s, overrunning the {}s interval; '
+                        'skipping {} cycle(s)'.format(elapsed, self.interval, missed))
+            elif self.logger:
+                self.logger.debug('Poll cycle took {:.3f}s'.format(elapsed))
+
+            slot = nextSlot
+            self.stopped.wait(max(0.0, start + slot * self.interval - self.clock()))
+
+    def Stop(self):
+        self.stopped.set()
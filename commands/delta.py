@@ -0,0 +1,122 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+
+class DeltaFilter(object):
+    """
+    Metric sink wrapper which suppresses device readings that did not
+    change. A metric is passed on when a field moved by more than the
+    absolute or relative threshold since the last metric passed on for the
+    same device, when its fields or tags changed, or when the heartbeat
+    interval has passed. Comparing against the last emitted values rather
+    than the last seen ones keeps a slow drift from being hidden. Metrics of
+    other measurements are passed through.
+    """
+
+    def __init__(self, pipeline, absolute=0.0, relative=0.0, heartbeat=300.0,
+            measurements=('emeter',), clock=time.monotonic):
+        """
+        :param pipeline: Metric sink callback.
+        :param absolute: Smallest absolute change which is emitted.
+        :param relative: Smallest change relative to the last emitted value.
+        :param heartbeat: Seconds after which a metric is emitted regardless.
+        :param measurements: Measurements which are filtered.
+        :param clock: Monotonic clock.
+        """
+        self.pipeline = pipeline
+        self.defaults = (float(absolute), float(relative), float(heartbeat))
+        self.measurements = set(measurements)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.thresholds = {}
+        self.last = {}
+        self.emitted = 0
+        self.suppressed = 0
+        self.suppressedDevices = {}
+
+    def __call__(self, metric):
+        if metric.measurement not in self.measurements:
+            self.pipeline(metric)
+            return
+        key = (metric.name, metric.measurement)
+        now = self.clock()
+        with self.lock:
+            absolute, relative, heartbeat = self.thresholds.get(metric.name, self.defaults)
+            last = self.last.get(key)
+            if last is not None and now - last[0] < heartbeat and last[1] == metric.tags and \
+                    not HasChanged(last[2], metric.fields, absolute, relative):
+                self.suppressed += 1
+                self.suppressedDevices[metric.name] = self.suppressedDevices.get(metric.name, 0) + 1
+                return
+        self.pipeline(metric)
+        with self.lock:
+            self.last[key] = (now, dict(metric.tags), dict(metric.fields))
+            self.emitted += 1
+
+    def Configure(self, name, absolute=None, relative=None, heartbeat=None):
+        """
+        Override the thresholds of a single device. Thresholds left as None
+        use the defaults of the filter.
+        """
+        defaults = self.defaults
+        with self.lock:
+            self.thresholds[name] = (
+                defaults[0] if absolute is None else float(absolute),
+                defaults[1] if relative is None else float(relative),
+                defaults[2] if heartbeat is None else float(heartbeat))
+
+    def Stats(self):
+        with self.lock:
+            total = self.emitted + self.suppressed
+            return {
+                'emitted': self.emitted,
+                'suppressed': self.suppressed,
+                'suppression_rate': float(self.suppressed) / total if total else 0.0,
+                'devices': dict(self.suppressedDevices),
+            }
+
+
+def HasChanged(previous, fields, absolute, relative):
+    """
+    :param previous: Fields of the last emitted metric.
+    :param fields: Fields of the new metric.
+    :param absolute: Smallest absolute change of a numeric field.
+    :param relative: Smallest change of a numeric field relative to its
+        previous value.
+    :return: True if a field changed by more than either threshold, or a
+        field was added, removed or changed type. A threshold of zero is
+        disabled; with both disabled any change counts.
+    """
+    if previous.keys() != fields.keys():
+        return True
+    for key, value in fields.items():
+        old = previous[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+                not isinstance(old, (int, float)):
+            if value != old:
+                return True
+            continue
+        change = abs(value - old)
+        if change == 0:
+            continue
+        if absolute <= 0 and relative <= 0:
+            return True
+        if absolute > 0 and change > absolute:
+            return True
+        if relative > 0 and change > relative * abs(old):
+            return True
+    return False
@@ -0,0 +1,33 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tplink.discover import DiscoverDevices
+from tplink.discover.broadcast import BROADCAST_ADDRESS
+
+
+def Discover(config, args):
+    devices = DiscoverDevices(address=args.address or BROADCAST_ADDRESS,
+        timeout=args.timeout)
+    if not devices:
+        print('No devices found')
+        return False
+
+    print('{:<16} {:<24} {:<12} {:<12} {}'.format(
+        'Address', 'Alias', 'Type', 'Model', 'Device Identifier'))
+    for device in devices:
+        print('{:<16} {:<24} {:<12} {:<12} {}'.format(
+            device.address, device.GetAlias() or '', device.GetType(),
+            device.GetModel() or '', device.GetDeviceIdentifier() or ''))
+    return True
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from tplink.discover import LoadDevices
+from tplink.discover import LoadDevices, Registry
+from tplink.group import DeviceGroup
+from tplink.pool import ConnectionPool
 
 commands = {
     'toggle': 'Disable the devices',
@@ -32,7 +34,15 @@ def IsNumber(value):
 
 def Interactive(config, args):
     target = None
-    devices = LoadDevices(args.devices)
+    pool = ConnectionPool() if args.keepalive else None
+    registry = None
+    if args.registry:
+        registry = Registry(args.registry)
+        registry.Load()
+    devices = LoadDevices(args.devices, pool=pool, registry=registry)
+    if registry is not None:
+        registry.Save()
+        registry.RevalidatePending()
     if len(devices) == 1:
         target = devices[0]
 
@@ -58,20 +68,23 @@ def Interactive(config, args):
                 for i in range(len(devices)):
                     print('{}) {} ({})'.format(i + 1, devices[i].GetAlias(), devices[i].address))
             elif command == 'reboot':
-                for i in range(len(devices)):
-                    print("Rebooting device '{}' ...".format(devices[i].GetAlias()))
-                    result = devices[i].Set('system', 'reboot', {'delay': 1})
-                    print("device='{}' result={}".format(devices[i].GetAlias(), result))
+                group = DeviceGroup()
+                for device in devices:
+                    print("Rebooting device '{}' ...".format(device.GetAlias()))
+                    group.Add(device, name=device.GetAlias())
+                for result in group.Reboot():
+                    print("device='{}' result={}".format(result.name, result.success))
             elif command == 'toggle':
-                for i in range(len(devices)):
-                    if devices[i].IsOn():
-                        devices[i].Off()
-                        print("Changing active state for '{}' to 'Off'".format(
-                            devices[i].GetAlias()))
-                    elif devices[i].IsOff():
-                        devices[i].On()
-                        print("Changing active state for '{}' to 'On'".format(
-                            devices[i].GetAlias()))
+                group = DeviceGroup()
+                for device in devices:
+                    group.Add(device, name=device.GetAlias())
+                for result in group.Toggle():
+                    if not result.success:
+                        print("Failed to change active state for '{}': {}".format(
+                            result.name, result.error))
+                    else:
+                        print("Changing active state for '{}' to '{}'".format(
+                            result.name, 'On' if result.state else 'Off'))
             elif command == 'use':
                 if len(args) == 0:
                     if target is not None:
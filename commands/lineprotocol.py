@@ -0,0 +1,50 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+def Escape(value, characters):
+    value = str(value).replace('\\', '\\\\')
+    for character in characters:
+        value = value.replace(character, '\\' + character)
+    return value
+
+
+def FormatField(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def FormatLine(measurement, tags, fields, timestamp=None):
+    """
+    Format a single point in the InfluxDB line protocol.
+
+    :param measurement: Measurement name.
+    :param tags: Dictionary of tag names to values.
+    :param fields: Dictionary of field names to values.
+    :param timestamp: Optional timestamp in nanoseconds.
+    :return: Line without the trailing newline.
+    """
+    key = Escape(measurement, ', ')
+    for name, value in sorted(tags.items()):
+        key += ',{}={}'.format(Escape(name, ',= '), Escape(value, ',= '))
+    line = '{} {}'.format(key, ','.join('{}={}'.format(Escape(name, ',= '), FormatField(value))
+        for name, value in sorted(fields.items())))
+    if timestamp is not None:
+        line += ' {}'.format(int(timestamp))
+    return line
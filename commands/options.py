@@ -0,0 +1,66 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+PREFIX = 'POLLER_'
+
+
+def GetOption(name, default=None, type=str):
+    """
+    Read a global poller option from the environment. The poll callback is
+    driven by monitor.lib and only receives the device sections, so options
+    which apply to the whole run are taken from 'POLLER_<NAME>' variables.
+
+    :param name: Option name, case-insensitive.
+    :param default: Value returned when the option is not set.
+    :param type: Callable used to convert the raw string value.
+    :return: Converted option value or the default.
+    """
+    value = os.environ.get(PREFIX + name.upper())
+    if value is None or len(value) == 0:
+        return default
+    return ParseValue(value, type, default)
+
+
+def GetDeviceOption(config, name, default=None, type=str):
+    """
+    Read an option from a device configuration section, falling back to the
+    global option of the same name.
+
+    :param config: Device configuration section.
+    :param name: Option name.
+    :param default: Value returned when neither is set.
+    :param type: Callable used to convert the raw value.
+    :return: Converted option value or the default.
+    """
+    value = config.get(name) if config is not None else None
+    if value is None or (isinstance(value, str) and len(value) == 0):
+        return GetOption(name, default, type)
+    return ParseValue(value, type, default)
+
+
+def ParseBool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def ParseValue(value, type, default=None):
+    if type is bool:
+        type = ParseBool
+    try:
+        return type(value)
+    except (TypeError, ValueError):
+        return default
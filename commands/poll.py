@@ -12,55 +12,397 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor, wait
 from monitor.lib import ConversionFailure, Metric, Result
-from tplink.discover import LoadDevice
-from tplink.exceptions import ConnectionError
+from tplink.breaker import CircuitBreaker
+from tplink.devices import Device, EmeterHandler
+from tplink.discover import BuildDevice, GetDeviceType, LoadDevice, Registry
+from tplink.exceptions import ConnectionError, DeviceError
+from tplink.latency import LatencyStats
+from tplink.pool import ConnectionPool
+from tplink.series import SeriesStore
 from tplink.utils import IsValidIPv4
+from .batch import BatchingPipeline, LineProtocolSink, PipelineSink
+from .daemon import Scheduler
+from .delta import DeltaFilter
+from .options import GetDeviceOption, GetOption, ParseBool
+from .schedule import DeviceSchedule
+from .shard import Partition, ShardSupervisor
+from .spool import Deserialize, Serialize, Spool, SpoolingPipeline
+import logging
+import os
+import time
 
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DEADLINE = 30.0
+DEFAULT_DELTA_HEARTBEAT = 300.0
+DEFAULT_HISTORY_SAVE = 60.0
+DEFAULT_BATCH_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BREAKER_DELAY = 30.0
+DEFAULT_BREAKER_MAX_DELAY = 600.0
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_INTERVAL = 60.0
+DEFAULT_KEEPALIVE_IDLE = 30.0
+DEFAULT_PROBE_TIMEOUT = 1.0
+DEFAULT_SHARD_TERMINATE = 10.0
+DEFAULT_SPOOL_MAX_SIZE = 256.0
+DEFAULT_SPOOL_RETRY = 5.0
+DEFAULT_SPOOL_SEGMENT_SIZE = 4.0
+DEFAULT_SPOOL_SYNC = 1.0
+DEFAULT_SYSINFO_INTERVAL = 3600.0
+MINIMUM_TICK = 0.1
 
-def ProcessDevice(pipeline, name, config, logger=None):
+batchPipeline = None
+breakers = {}
+connectionPool = None
+deltaFilter = None
+deviceRegistry = None
+history = None
+historySaved = None
+latencies = {}
+liveDevices = {}
+schedules = {}
+spoolPipeline = None
+sysinfoRefreshed = {}
+
+
+def BreakerMetric(name, config, breaker):
+    """
+    Build the metric reporting the circuit breaker state of a device.
+    """
+    metric = Metric(name, 'breaker', tags=GetTags(config))
+    metric.AddField('state', breaker.state)
+    metric.AddField('failures', breaker.failures)
+    return metric
+
+
+def CheckDeviceType(device, sysinfo):
+    """
+    :param device: Device object in use.
+    :param sysinfo: Freshly queried sysinfo of the device.
+    :return: False if the sysinfo reports a different device type or no
+        emeter. Missing sysinfo is not treated as a mismatch.
+    """
+    if not isinstance(sysinfo, dict) or sysinfo.get('err_code', 0) != 0:
+        return True
+    try:
+        DeviceType = GetDeviceType({'system': {'get_sysinfo': sysinfo}})
+    except DeviceError:
+        return True
+    features = (sysinfo.get('feature') or '').split(':')
+    if device.IsPlug() and 'feature' in sysinfo and 'ENE' not in features:
+        return False
+    return DeviceType is None or type(device) is DeviceType
+
+
+def ConfigureDeltaFilter(config):
+    """
+    Apply the delta_absolute, delta_relative and delta_heartbeat overrides
+    of every device to the delta filter, when POLLER_DELTA is enabled.
+    """
+    if deltaFilter is None:
+        return
+    for name, cfg in config.items():
+        deltaFilter.Configure(name,
+            absolute=GetDeviceOption(cfg, 'delta_absolute', None, float),
+            relative=GetDeviceOption(cfg, 'delta_relative', None, float),
+            heartbeat=GetDeviceOption(cfg, 'delta_heartbeat', None, float))
+
+
+def GetBreaker(name):
+    """
+    Return the circuit breaker of a device, created from the POLLER_BREAKER_*
+    options on first use.
+    """
+    breaker = breakers.get(name)
+    if breaker is None:
+        # An unresolved probe expires after a cycle deadline, so a probe
+        # cancelled by the deadline is sent again on a later cycle.
+        deadline = GetOption('deadline', DEFAULT_DEADLINE, float)
+        breaker = breakers[name] = CircuitBreaker(
+            threshold=GetOption('breaker_threshold', DEFAULT_BREAKER_THRESHOLD, int),
+            delay=GetOption('breaker_delay', DEFAULT_BREAKER_DELAY, float),
+            maxDelay=GetOption('breaker_max_delay', DEFAULT_BREAKER_MAX_DELAY, float),
+            probeTimeout=deadline if deadline > 0 else DEFAULT_DEADLINE)
+    return breaker
+
+
+def GetConnectionPool():
+    """
+    Return the connection pool shared by every poll cycle, or None when
+    persistent connections are not enabled with POLLER_KEEPALIVE.
+    """
+    global connectionPool
+    if connectionPool is None and GetOption('keepalive', False, bool):
+        connectionPool = ConnectionPool(
+            idleTimeout=GetOption('keepalive_idle', DEFAULT_KEEPALIVE_IDLE, float))
+    return connectionPool
+
+
+def GetHistory(logger=None):
+    """
+    Return the shared time series store when POLLER_HISTORY is set, loading
+    the saved history from POLLER_HISTORY_FILE on first use.
+    """
+    global history
+    hours = GetOption('history', 0.0, float)
+    if history is None and hours > 0:
+        history = SeriesStore(hours)
+        path = GetOption('history_file')
+        if path and not history.Load(path) and logger:
+            logger.debug("No readable history in '{}'".format(path))
+    return history
+
+
+def GetLatency(name):
+    """
+    Return the latency histograms of a device when POLLER_LATENCY is enabled.
+    """
+    if not GetOption('latency', False, bool):
+        return None
+    latency = latencies.get(name)
+    if latency is None:
+        latency = latencies[name] = LatencyStats()
+    return latency
+
+
+def GetPipeline(pipeline, logger=None):
+    """
+    Wrap the metric sink in the optional delivery stages. With POLLER_SPOOL
+    metrics the sink fails to accept are spooled to disk. With
+    POLLER_BATCH_SIZE or POLLER_BATCH_URL metrics are submitted in batches,
+    to the sink or straight to an InfluxDB write endpoint, in which case the
+    spool takes the batches the endpoint fails to accept. With POLLER_DELTA
+    unchanged emeter readings are suppressed before any of these stages.
+    """
+    global batchPipeline, deltaFilter, spoolPipeline
+    path = GetOption('spool')
+    url = GetOption('batch_url')
+    size = GetOption('batch_size', 0, int)
+    if path:
+        if spoolPipeline is None:
+            megabyte = 1024 * 1024
+            spool = Spool(path,
+                segmentSize=GetOption('spool_segment_size', DEFAULT_SPOOL_SEGMENT_SIZE, float) * megabyte,
+                maxSize=GetOption('spool_max_size', DEFAULT_SPOOL_MAX_SIZE, float) * megabyte,
+                syncInterval=GetOption('spool_sync', DEFAULT_SPOOL_SYNC, float), logger=logger)
+            spoolPipeline = SpoolingPipeline(pipeline, spool, logger=logger)
+        spoolPipeline.pipeline = pipeline
+        if url:
+            # Batches posted to the write endpoint bypass the sink, so the
+            # spool sits behind the batches instead.
+            if spoolPipeline.batchSink is None:
+                spoolPipeline.batchSink = LineProtocolSink(url,
+                    compress=GetOption('batch_gzip', True, bool))
+        else:
+            pipeline = spoolPipeline
+
+    if url or size > 1:
+        if batchPipeline is None:
+            if url and path:
+                sink = spoolPipeline.Submit
+            elif url:
+                sink = LineProtocolSink(url, compress=GetOption('batch_gzip', True, bool))
+            else:
+                sink = PipelineSink(pipeline)
+            batchPipeline = BatchingPipeline(sink, size=size if size > 1 else DEFAULT_BATCH_SIZE,
+                interval=GetOption('batch_interval', DEFAULT_BATCH_INTERVAL, float), logger=logger)
+        if isinstance(batchPipeline.sink, PipelineSink):
+            batchPipeline.sink.pipeline = pipeline
+        pipeline = batchPipeline
+
+    if not GetOption('delta', False, bool):
+        return pipeline
+    if deltaFilter is None:
+        deltaFilter = DeltaFilter(pipeline,
+            absolute=GetOption('delta_absolute', 0.0, float),
+            relative=GetOption('delta_relative', 0.0, float),
+            heartbeat=GetOption('delta_heartbeat', DEFAULT_DELTA_HEARTBEAT, float))
+    deltaFilter.pipeline = pipeline
+    return deltaFilter
+
+
+def GetRegistry(logger=None):
+    """
+    Return the device registry shared by every poll cycle, or None when no
+    registry file is configured with POLLER_REGISTRY.
+    """
+    global deviceRegistry
+    path = GetOption('registry')
+    if deviceRegistry is None and path:
+        deviceRegistry = Registry(path, logger=logger)
+        deviceRegistry.Load()
+    return deviceRegistry
+
+
+def GetTags(config):
+    tags = {'device': config['device']}
+    tags.update(config.get('tags', {}))
+    return tags
+
+
+def GetTimeouts(config):
+    """
+    :return: Tuple of (connect, read) timeouts of a device in seconds.
+    """
+    return (GetDeviceOption(config, 'connect_timeout', Device.TIMEOUT, float),
+        GetDeviceOption(config, 'read_timeout', Device.TIMEOUT, float))
+
+
+def LatencyMetrics(name, config, latency):
+    """
+    Build one metric per request phase from the latency histograms of a
+    device, tagged with the phase name.
+    """
+    metrics = []
+    for phase, fields in sorted(latency.Snapshot().items()):
+        tags = GetTags(config)
+        tags['phase'] = phase
+        metric = Metric(name, 'latency', tags=tags)
+        for key, value in fields.items():
+            metric.AddField(key, value)
+        metrics.append(metric)
+    return metrics
+
+
+def ProcessDevice(pipeline, name, config, logger=None, pool=None, devices=None,
+        results=None, registry=None, timeout=None, latency=None, refreshed=None):
+    """
+    Poll the realtime emeter data of a single device and pass the metric to
+    the pipeline.
+
+    :param pipeline: Metric sink callback.
+    :param name: Device configuration name.
+    :param config: Device configuration section.
+    :param logger: Logger instance.
+    :param pool: Optional connection pool.
+    :param devices: Optional dictionary of device objects kept between
+        cycles. Known devices skip type detection and only query the emeter.
+    :param results: Optional dictionary receiving the RealtimeSample of the
+        device when the poll succeeds, or None when it could not be reached.
+    :param registry: Optional device registry used to skip type detection.
+    :param timeout: Optional upper bound of the connect and read timeouts
+        used for this poll only.
+    :param latency: Optional LatencyStats attached to a newly loaded device.
+    :param refreshed: Optional dictionary of device name to the monotonic
+        time the sysinfo of a known device was last refreshed. Once
+        POLLER_SYSINFO_INTERVAL has passed the sysinfo is queried along
+        with the realtime data to check the device type.
+    :return: False if the device is misconfigured or unsupported.
+    """
     address = config['address']
     if not IsValidIPv4(address):
         if logger:
             logger.error('Invalid device configuration: {}'.format(name))
         return False
 
-    try:
-        device = LoadDevice(address, logger=logger)
-    except ConnectionError as e:
-        if logger:
-            logger.warning('Failed to connect to: {}'.format(address))
-        return True
+    port = int(config.get('port', Device.DEFAULT_PORT))
+    device = devices.get(name) if devices is not None else None
+    if device is not None and (device.address, device.port) != (address, port):
+        device = None
 
-    if not device.HasEmeter():
-        if logger:
-            logger.warning("Device '{}' does not support electronic metering".format(
-                device.GetAlias()))
-        return False
+    connectTimeout, readTimeout = GetTimeouts(config)
+    if timeout is not None:
+        current = (min(connectTimeout, timeout), min(readTimeout, timeout))
+    else:
+        current = (connectTimeout, readTimeout)
 
-    emeter = device.GetEmeter()
+    # Devices with a declared type are built without type detection, so
+    # polling them only sends the emeter realtime query.
+    loaded = False
+    if device is None and config.get('type'):
+        device = BuildDevice(config['type'], address, port=port,
+            emeter=ParseBool(config.get('emeter', True)), logger=logger, pool=pool,
+            connectTimeout=connectTimeout, timeout=readTimeout, latency=latency)
+        if device is None:
+            if logger:
+                logger.error("Unknown device type '{}' for '{}'".format(config['type'], name))
+            return False
+        if refreshed is not None:
+            refreshed[name] = time.monotonic()
+        if not device.HasEmeter():
+            if logger:
+                logger.warning("Device '{}' does not support electronic metering".format(name))
+            return False
+        device.GetEmeter()
+        if devices is not None:
+            devices[name] = device
+
+    if device is None:
+        loaded = True
+        try:
+            device = LoadDevice(address, port=port, logger=logger, pool=pool,
+                queries=EmeterHandler.RealtimeQueries(), registry=registry,
+                connectTimeout=current[0], timeout=current[1], latency=latency)
+        except ConnectionError as e:
+            if logger:
+                logger.warning('Failed to connect to: {}'.format(address))
+            if results is not None:
+                results[name] = None
+            return True
+
+        if device is None:
+            if logger:
+                logger.error("Unable to determine device type for '{}'".format(name))
+            return False
+
+        if not device.HasEmeter():
+            if logger:
+                logger.warning("Device '{}' does not support electronic metering".format(
+                    device.GetAlias()))
+            return False
+
+        device.GetEmeter()
+        if devices is not None:
+            devices[name] = device
+        if refreshed is not None:
+            refreshed[name] = time.monotonic()
+
+    # The realtime data of a freshly loaded device arrived with the sysinfo
+    # request. Known devices query the emeter directly, with the sysinfo
+    # batched in the same request once it is due for a refresh.
+    emeter = device.emeter
+    refresh = not loaded and refreshed is not None and time.monotonic() - refreshed.get(name, 0) >= \
+        GetDeviceOption(config, 'sysinfo_interval', DEFAULT_SYSINFO_INTERVAL, float)
+    device.connectTimeout, device.timeout = current
     try:
-        result = emeter.GetRealtime(cache=False)
+        if refresh:
+            batch = device.Batch([('system', 'get_sysinfo', None),
+                (emeter.emeterType, 'get_realtime', None)])
+            refreshed[name] = time.monotonic()
+            if not CheckDeviceType(device, batch.get(('system', 'get_sysinfo'))):
+                if logger:
+                    logger.warning("Device '{}' no longer matches its known type, reloading it".format(name))
+                if devices is not None:
+                    devices.pop(name, None)
+                if results is not None:
+                    results[name] = None
+                return False
+        sample = emeter.GetSample(cache=loaded or refresh)
     except ConnectionError:
         if logger:
             logger.warning('Failed to get realtime data for: {}'.format(address))
+        if results is not None:
+            results[name] = None
         return True
+    finally:
+        device.connectTimeout, device.timeout = connectTimeout, readTimeout
 
-    if 'err_code' not in result or result['err_code'] != 0:
+    if sample.errorCode != 0:
         if logger:
             logger.error("Failed to load device '{}' emeter data".format(device.GetAlias()))
         return False
 
-    tags = {'device': config['device']}
-    tags.update(config.get('tags', {}))
+    if results is not None:
+        results[name] = sample
 
-    metric = Metric(name, 'emeter', tags=tags)
+    metric = Metric(name, 'emeter', tags=GetTags(config))
     measurements = config['measurements'][metric.measurement]
 
-    for key, value in result.items():
-        if key not in measurements:
-            continue
-        metric.AddField(key, value)
+    for key, value in sample.Items():
+        if key in measurements:
+            metric.AddField(key, value)
 
     try:
         pipeline(metric)
@@ -72,18 +414,485 @@ def ProcessDevice(pipeline, name, config, logger=None):
 
 def Poll(config, logger, pipeline):
     """
+    Entry point for the run command. Runs a single poll cycle, or when
+    POLLER_DAEMON is enabled keeps polling on a fixed-rate schedule until
+    interrupted. Device objects are kept between cycles in both modes. With
+    POLLER_SHARDS the devices are polled by that many worker processes.
+
+    :param config: Mapping of device name to device configuration.
+    :param logger: Logger instance.
+    :param pipeline: Metric sink callback.
+    :return: Result of the poll.
+    """
+    pipeline = GetPipeline(pipeline, logger)
+    shards = GetOption('shards', 1, int)
+    if shards > 1:
+        return RunSharded(config, logger, pipeline, shards)
+    if GetOption('daemon', False, bool):
+        return RunDaemon(config, logger, pipeline,
+            GetOption('interval', DEFAULT_INTERVAL, float))
+
+    # Replay metrics spooled by earlier runs before adding new ones.
+    if spoolPipeline is not None:
+        spoolPipeline.Drain()
+
+    # Without the daemon the cycle rate is set by the caller, so devices
+    # are polled every cycle unless they configure their own interval.
+    now = time.monotonic()
+    due = GetDueDevices(config, schedules, 0, now)
+    results = {}
+    result = PollCycle(due, logger, pipeline, devices=liveDevices, results=results)
+    UpdateSchedules(due, schedules, results, now)
+    RecordHistory(due, schedules, results, logger, now, save=True)
+    if batchPipeline is not None:
+        batchPipeline.Flush()
+    if spoolPipeline is not None:
+        spoolPipeline.spool.Sync()
+    return result
+
+
+def GetDueDevices(config, schedules, interval, now, slack=0.0):
+    """
+    Select the devices whose schedule is due, creating schedules for
+    devices seen for the first time.
+
+    :param config: Mapping of device name to device configuration.
+    :param schedules: Dictionary of device name to DeviceSchedule.
+    :param interval: Default polling interval in seconds.
+    :param now: Current monotonic time.
+    :param slack: Tolerance for devices due shortly after now.
+    :return: Mapping of the due devices in configuration order.
+    """
+    due = {}
+    for name, cfg in config.items():
+        schedule = schedules.get(name)
+        if schedule is None:
+            schedule = schedules[name] = DeviceSchedule.FromConfig(cfg, interval)
+        if schedule.IsDue(now, slack):
+            due[name] = cfg
+    return due
 
-    :param config:
-    :param logger:
-    :param pipeline:
-    :return:
+
+def PollCycle(config, logger, pipeline, devices=None, deadline=None, results=None):
+    """
+    Poll every configured device concurrently. Devices are processed on a
+    bounded thread pool and the cycle is abandoned once the deadline has
+    passed. Metrics are collected per device and handed to the pipeline in
+    configuration order once the cycle completes so that the sink sees the
+    same ordering regardless of which device answered first.
+
+    :param config: Mapping of device name to device configuration.
+    :param logger: Logger instance.
+    :param pipeline: Metric sink callback.
+    :param devices: Optional dictionary of device objects kept between cycles.
+    :param deadline: Cycle deadline in seconds, defaults to POLLER_DEADLINE.
+    :param results: Optional dictionary receiving the RealtimeSample of every
+        device polled successfully, or None for devices which failed.
+    :return: Result of the poll cycle.
     """
+    concurrency = max(1, GetOption('concurrency', DEFAULT_CONCURRENCY, int))
+    if deadline is None:
+        deadline = GetOption('deadline', DEFAULT_DEADLINE, float)
+
+    entries = list(config.items())
+    if not entries:
+        return Result.SUCCESS
+
+    ConfigureDeltaFilter(config)
+
+    pool = GetConnectionPool()
+    registry = GetRegistry(logger)
+    probeTimeout = GetOption('probe_timeout', DEFAULT_PROBE_TIMEOUT, float)
+    results = {} if results is None else results
+    collected = {name: [] for name, _ in entries}
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(entries)),
+        thread_name_prefix='poll')
+    start = time.monotonic()
+    try:
+        futures = {}
+        for name, cfg in entries:
+            # Devices with an open breaker are skipped without touching the
+            # network; a half-open breaker sends one probe with a short timeout.
+            breaker = GetBreaker(name)
+            if not breaker.Allow():
+                continue
+            future = executor.submit(ProcessDevice, collected[name].append, name, cfg,
+                logger=logger, pool=pool, devices=devices, results=results,
+                registry=registry, timeout=probeTimeout if breaker.IsProbing() else None,
+                latency=GetLatency(name), refreshed=sysinfoRefreshed)
+            futures[future] = name
+        done, pending = wait(futures, timeout=deadline if deadline > 0 else None)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
     success = True
-    for device, cfg in config.items():
+    failed = set()
+    for future in pending:
+        success = False
+        # Devices queued behind the ones which held the pool past the
+        # deadline were never contacted and leave their breaker alone.
+        if future.cancelled():
+            if logger:
+                logger.warning("Device '{}' was not polled within the {}s poll deadline".format(
+                    futures[future], deadline))
+            continue
+        results.setdefault(futures[future], None)
+        failed.add(futures[future])
+        if logger:
+            logger.warning("Device '{}' did not finish within the {}s poll deadline".format(
+                futures[future], deadline))
+
+    for future in done:
         try:
-            ProcessDevice(pipeline, device, cfg, logger=logger)
+            future.result()
         except ConnectionError as e:
+            failed.add(futures[future])
+            if logger:
+                logger.error("Failed to connect to '{}': {}".format(futures[future], e.message))
+        except Exception as e:
+            success = False
+            failed.add(futures[future])
             if logger:
-                logger.error("Failed to connect to '{}': {}".format(device, e.message))
+                logger.exception("Failed to poll '{}': {}".format(futures[future], e))
+
+    # Every device which was contacted resolves its breaker, so a probe
+    # which ends without a sample opens it again rather than leaving it
+    # half-open.
+    for future, name in futures.items():
+        if future.cancelled():
+            continue
+        if name in failed or results.get(name) is None:
+            breakers[name].RecordFailure()
+        else:
+            breakers[name].RecordSuccess()
+
+    finished = {futures[future] for future in done}
+    for name, cfg in entries:
+        metrics = collected[name] if name in finished else []
+        metrics.append(BreakerMetric(name, cfg, breakers[name]))
+        if name in latencies:
+            metrics.extend(LatencyMetrics(name, cfg, latencies[name]))
+        for metric in metrics:
+            try:
+                pipeline(metric)
+            except ConversionFailure:
+                pass
+
+    if pool is not None:
+        pool.Prune()
+    if registry is not None:
+        registry.Save()
+        registry.RevalidatePending()
+
+    if logger:
+        logger.debug('Polled {} devices in {:.3f}s'.format(
+            len(entries), time.monotonic() - start))
+        if pool is not None:
+            stats = pool.Stats()
+            logger.debug('Connection pool: reuse rate {:.1%}, {} connects, '
+                'average connect {:.1f}ms, max connect {:.1f}ms'.format(
+                    stats['reuse_rate'], stats['connects'],
+                    stats['connect_time_avg'] * 1000, stats['connect_time_max'] * 1000))
+        if batchPipeline is not None:
+            stats = batchPipeline.Stats()
+            logger.debug('Metric batches: {} batches, average size {:.1f}, max size {}, '
+                'average flush {:.1f}ms, max flush {:.1f}ms, {} dropped'.format(
+                    stats['batches'], stats['batch_size_avg'], stats['batch_size_max'],
+                    stats['flush_time_avg'] * 1000, stats['flush_time_max'] * 1000,
+                    stats['dropped']))
+        if deltaFilter is not None:
+            stats = deltaFilter.Stats()
+            logger.debug('Delta filter: {} emitted, {} suppressed ({:.1%})'.format(
+                stats['emitted'], stats['suppressed'], stats['suppression_rate']))
 
     return Result.SUCCESS if success else Result.FAILURE
+
+
+def RecordHistory(config, schedules, results, logger, now, save=False):
+    """
+    Add the readings of a cycle to the time series store and save it when
+    POLLER_HISTORY_SAVE seconds passed since the last save.
+
+    :param config: Mapping of the polled devices.
+    :param schedules: Dictionary of device name to DeviceSchedule.
+    :param results: Dictionary of device name to RealtimeSample.
+    :param logger: Logger instance.
+    :param now: Monotonic time the cycle started.
+    :param save: Save regardless of the time since the last save.
+    :return: None
+    """
+    global historySaved
+    store = GetHistory(logger)
+    if store is None:
+        return
+    for name in config:
+        sample = results.get(name)
+        if sample is None:
+            continue
+        interval = schedules[name].GetMinimumInterval()
+        store.Record(name, sample, interval or GetOption('interval', DEFAULT_INTERVAL, float))
+    if save or historySaved is None or \
+            now - historySaved >= GetOption('history_save', DEFAULT_HISTORY_SAVE, float):
+        SaveHistory(logger)
+        historySaved = now
+
+
+def RunDaemon(config, logger, pipeline, interval, onCycle=None):
+    """
+    Poll the configured devices on a fixed-rate, drift-compensated schedule
+    until interrupted. Device objects stay alive between cycles so steady
+    state polling only sends the emeter realtime query.
+
+    :param config: Mapping of device name to device configuration.
+    :param logger: Logger instance.
+    :param pipeline: Metric sink callback.
+    :param interval: Seconds between the start of consecutive cycles.
+    :param onCycle: Optional callback invoked after every tick with the
+        due devices, their results, the cycle duration and the scheduler.
+    :return: Result of the poll.
+    """
+    deadline = min(GetOption('deadline', DEFAULT_DEADLINE, float), interval)
+
+    # Tick at the shortest interval any device may need and only poll the
+    # devices which are due on each tick.
+    tick = interval
+    for name, cfg in config.items():
+        schedule = schedules.get(name)
+        if schedule is None:
+            schedule = schedules[name] = DeviceSchedule.FromConfig(cfg, interval)
+        tick = min(tick, schedule.GetMinimumInterval())
+    tick = max(tick, MINIMUM_TICK)
+
+    def Cycle():
+        now = time.monotonic()
+        due = GetDueDevices(config, schedules, interval, now, slack=tick / 2)
+        results = {}
+        if due:
+            PollCycle(due, logger, pipeline, devices=liveDevices, deadline=deadline,
+                results=results)
+            UpdateSchedules(due, schedules, results, now)
+            RecordHistory(due, schedules, results, logger, now)
+        if onCycle is not None:
+            onCycle(due, results, time.monotonic() - now, scheduler)
+
+    if spoolPipeline is not None:
+        spoolPipeline.Start(GetOption('spool_retry', DEFAULT_SPOOL_RETRY, float))
+    if batchPipeline is not None:
+        batchPipeline.Start()
+
+    scheduler = Scheduler(tick, logger=logger)
+    if logger:
+        logger.info('Polling {} devices every {}s (tick {}s)'.format(
+            len(config), interval, tick))
+    try:
+        scheduler.Run(Cycle)
+    except KeyboardInterrupt:
+        if logger:
+            logger.info('Stopping poller after {} cycles ({} overruns)'.format(
+                scheduler.cycles, scheduler.overruns))
+    if batchPipeline is not None:
+        batchPipeline.Stop()
+    if spoolPipeline is not None:
+        spoolPipeline.Stop()
+    SaveHistory(logger)
+    return Result.SUCCESS
+
+
+def RunShard(shard, config, messages, daemon, interval, level):
+    """
+    Worker process of the sharded poller. Polls the devices of one shard
+    and sends the metrics, readings and statistics of every cycle to the
+    parent in a single message. Delivery stages, the history and the
+    shard metrics are handled by the parent.
+
+    :param shard: Shard index.
+    :param config: Mapping of device name to device configuration.
+    :param messages: Queue shared with the parent.
+    :param daemon: Keep polling on a schedule instead of a single cycle.
+    :param interval: Seconds between cycles in daemon mode.
+    :param level: Log level of the parent.
+    """
+    logging.basicConfig(level=level,
+        format='%(asctime)s shard-{} %(levelname)s %(message)s'.format(shard))
+    logger = logging.getLogger('poller.shard{}'.format(shard))
+    os.environ.pop('POLLER_HISTORY', None)
+    # Every shard shares the registry file, so the workers only read it and
+    # the parent saves the entries they report.
+    global deviceRegistry
+    path = GetOption('registry')
+    if path:
+        deviceRegistry = Registry(path, logger=logger, readOnly=True)
+        deviceRegistry.Load()
+    parent = os.getppid()
+    pending = []
+
+    def Report(due, results, duration, scheduler):
+        stats = {
+            'polled': len(due),
+            'failed': sum(1 for name in due if results.get(name) is None),
+            'duration': duration,
+            'overruns': scheduler.overruns if scheduler is not None else 0,
+        }
+        metrics = [Serialize(metric) for metric in pending]
+        del pending[:]
+        messages.put(('cycle', shard, {'stats': stats, 'metrics': metrics, 'results': results,
+            'registry': deviceRegistry.Changes() if deviceRegistry is not None else {}}))
+        if os.getppid() != parent:
+            raise SystemExit('Parent process exited')
+
+    try:
+        if daemon:
+            RunDaemon(config, logger, pending.append, interval, onCycle=Report)
+        else:
+            now = time.monotonic()
+            due = GetDueDevices(config, schedules, 0, now)
+            results = {}
+            PollCycle(due, logger, pending.append, devices=liveDevices, results=results)
+            Report(due, results, time.monotonic() - now, None)
+    except KeyboardInterrupt:
+        pass
+
+
+def RunSharded(config, logger, pipeline, shards):
+    """
+    Split the devices over worker processes by a consistent hash of their
+    address and deliver the metrics the workers send to the pipeline. In
+    daemon mode workers which exit or stop reporting are restarted. A
+    'shard' metric with the cycle statistics of a shard is delivered after
+    every cycle of that shard.
+
+    :param config: Mapping of device name to device configuration.
+    :param logger: Logger instance.
+    :param pipeline: Metric sink callback.
+    :param shards: Number of worker processes.
+    :return: Result of the poll.
+    """
+    daemon = GetOption('daemon', False, bool)
+    interval = GetOption('interval', DEFAULT_INTERVAL, float)
+    partitions = Partition(config, shards)
+    for name, cfg in config.items():
+        if name not in schedules:
+            schedules[name] = DeviceSchedule.FromConfig(cfg, interval if daemon else 0)
+    supervisor = ShardSupervisor(RunShard, partitions, args=(daemon, interval,
+            logger.getEffectiveLevel() if logger else logging.WARNING),
+        restart=daemon,
+        stallTimeout=3 * interval + GetOption('deadline', DEFAULT_DEADLINE, float) if daemon else None,
+        logger=logger)
+
+    def Handle(messages):
+        for (kind, shard, payload) in messages:
+            if kind != 'cycle':
+                continue
+            for data in payload['metrics']:
+                try:
+                    pipeline(Deserialize(data))
+                except ConversionFailure:
+                    pass
+            due = {name: config[name] for name in payload['results'] if name in config}
+            RecordHistory(due, schedules, payload['results'], logger, time.monotonic())
+            registry = GetRegistry(logger)
+            if registry is not None and payload['registry']:
+                registry.Merge(payload['registry'])
+                registry.Save()
+            stats = supervisor.Stats()[shard]
+            if payload['stats']['polled']:
+                try:
+                    pipeline(ShardMetric(shard, stats))
+                except ConversionFailure:
+                    pass
+                if logger:
+                    logger.debug('Shard {}: polled {} of {} devices in {:.3f}s, {} failed, '
+                        'average {:.3f}s, max {:.3f}s, {} restarts'.format(
+                            shard, stats['polled'], stats['devices'], stats['duration'],
+                            stats['failed'], stats['duration_avg'], stats['duration_max'],
+                            stats['restarts']))
+                    if deltaFilter is not None:
+                        stats = deltaFilter.Stats()
+                        logger.debug('Delta filter: {} emitted, {} suppressed ({:.1%})'.format(
+                            stats['emitted'], stats['suppressed'], stats['suppression_rate']))
+
+    if daemon:
+        if spoolPipeline is not None:
+            spoolPipeline.Start(GetOption('spool_retry', DEFAULT_SPOOL_RETRY, float))
+        if batchPipeline is not None:
+            batchPipeline.Start()
+    elif spoolPipeline is not None:
+        spoolPipeline.Drain()
+
+    # Workers have no delta filter; the parent filters what they send.
+    ConfigureDeltaFilter(config)
+    if logger:
+        logger.info('Polling {} devices with {} shards'.format(len(config), shards))
+    supervisor.Start()
+    try:
+        while supervisor.IsRunning():
+            Handle(supervisor.Receive(timeout=1.0))
+            supervisor.Supervise()
+    except KeyboardInterrupt:
+        # The workers received the interrupt as well and finish their cycle.
+        supervisor.Stop()
+        deadline = time.monotonic() + DEFAULT_SHARD_TERMINATE
+        while supervisor.IsRunning() and time.monotonic() < deadline:
+            Handle(supervisor.Receive(timeout=0.1))
+    supervisor.Terminate(timeout=0)
+    Handle(supervisor.Receive(timeout=0))
+
+    if logger:
+        for shard, stats in sorted(supervisor.Stats().items()):
+            logger.info('Shard {}: {} devices, {} cycles, average {:.3f}s, max {:.3f}s, '
+                '{} overruns, {} restarts'.format(shard, stats['devices'], stats['cycles'],
+                    stats['duration_avg'], stats['duration_max'], stats['overruns'],
+                    stats['restarts']))
+    if batchPipeline is not None:
+        if daemon:
+            batchPipeline.Stop()
+        else:
+            batchPipeline.Flush()
+    if spoolPipeline is not None:
+        if daemon:
+            spoolPipeline.Stop()
+        else:
+            spoolPipeline.spool.Sync()
+    SaveHistory(logger)
+    # Restarted workers are reported in the shard stats; only a single run
+    # fails when one of its workers did.
+    return Result.FAILURE if supervisor.failed and not daemon else Result.SUCCESS
+
+
+def SaveHistory(logger=None):
+    path = GetOption('history_file')
+    if history is None or not path:
+        return
+    try:
+        history.Save(path)
+    except OSError as e:
+        if logger:
+            logger.warning("Failed to save history '{}': {}".format(path, e))
+
+
+def ShardMetric(shard, stats):
+    """
+    Build the metric reporting the cycle statistics of a poller shard.
+    """
+    metric = Metric('shard{}'.format(shard), 'shard', tags={'shard': str(shard)})
+    for key in ('devices', 'polled', 'failed', 'duration', 'duration_avg', 'duration_max',
+            'overruns', 'restarts'):
+        metric.AddField(key, stats[key])
+    return metric
+
+
+def UpdateSchedules(config, schedules, results, now):
+    """
+    Advance the schedule of every polled device using the power reading
+    from the cycle. Devices missing from the results failed to poll.
+
+    :param config: Mapping of the polled devices.
+    :param schedules: Dictionary of device name to DeviceSchedule.
+    :param results: Dictionary of device name to RealtimeSample.
+    :param now: Monotonic time the cycle started.
+    :return: None
+    """
+    for name in config:
+        result = results.get(name)
+        power = result.power if result is not None else None
+        schedules[name].Update(now, float(power) if power is not None else None)
@@ -0,0 +1,85 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from .options import GetDeviceOption
+
+DEFAULT_THRESHOLD = 5.0
+BACKOFF_FACTOR = 2.0
+
+
+class DeviceSchedule(object):
+    """
+    Polling schedule of a single device. A fixed schedule polls every
+    interval. An adaptive schedule drops to the minimum interval while the
+    power reading is changing by more than the threshold and backs off
+    exponentially towards the maximum interval while readings are flat or
+    the device cannot be reached.
+    """
+
+    def __init__(self, interval, adaptive=False, minInterval=None, maxInterval=None,
+            threshold=DEFAULT_THRESHOLD):
+        self.interval = float(interval)
+        self.adaptive = bool(adaptive)
+        self.minInterval = float(minInterval or self.interval)
+        self.maxInterval = float(maxInterval or self.interval * 10)
+        self.minInterval = min(self.minInterval, self.interval)
+        self.maxInterval = max(self.maxInterval, self.interval)
+        self.threshold = float(threshold)
+        self.current = self.interval
+        self.due = 0.0
+        self.power = None
+
+    @classmethod
+    def FromConfig(cls, config, interval):
+        """
+        Build the schedule from a device configuration section. Options not
+        set on the device fall back to the POLLER_* environment.
+
+        :param config: Device configuration section.
+        :param interval: Default polling interval in seconds.
+        :return: DeviceSchedule instance.
+        """
+        return cls(GetDeviceOption(config, 'interval', interval, float),
+            adaptive=GetDeviceOption(config, 'adaptive', False, bool),
+            minInterval=GetDeviceOption(config, 'min_interval', None, float),
+            maxInterval=GetDeviceOption(config, 'max_interval', None, float),
+            threshold=GetDeviceOption(config, 'adaptive_threshold', DEFAULT_THRESHOLD, float))
+
+    def GetMinimumInterval(self):
+        return self.minInterval if self.adaptive else self.interval
+
+    def IsDue(self, now, slack=0.0):
+        return now + slack >= self.due
+
+    def Update(self, now, power=None):
+        """
+        Record the outcome of a poll and compute when the device is due next.
+
+        :param now: Monotonic time of the poll.
+        :param power: Power reading in watts, or None if the poll failed.
+        :return: Interval until the next poll in seconds.
+        """
+        if not self.adaptive:
+            self.current = self.interval
+        elif power is None:
+            self.current = min(self.current * BACKOFF_FACTOR, self.maxInterval)
+        else:
+            if self.power is not None and abs(power - self.power) >= self.threshold:
+                self.current = self.minInterval
+            else:
+                self.current = min(self.current * BACKOFF_FACTOR, self.maxInterval)
+            self.power = power
+        self.due = now + self.current
+        return self.current
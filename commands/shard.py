@@ -0,0 +1,220 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import multiprocessing
+import queue
+import time
+
+
+class ShardSupervisor(object):
+    """
+    Runs one worker process per shard and collects the messages they send
+    to a shared queue. Workers which exit or stop reporting are restarted
+    with an exponential backoff. Workers are started with spawn so they do
+    not inherit the threads or sockets of the parent.
+
+    Workers send ('cycle', shard, payload) messages where payload is a
+    dictionary holding at least the cycle 'stats'; the stats are folded
+    into the per-shard statistics returned by Stats.
+    """
+
+    def __init__(self, target, partitions, args=(), restart=True, stallTimeout=None,
+            restartDelay=1.0, maxRestartDelay=60.0, logger=None, clock=time.monotonic):
+        """
+        :param target: Worker function called as target(shard, config,
+            messages, *args). Must be importable by the spawned process.
+        :param partitions: List with the device configuration of each shard.
+        :param args: Extra arguments passed to every worker.
+        :param restart: Restart workers which exit, for long running modes.
+        :param stallTimeout: Seconds without a report after which a worker
+            is considered hung and restarted.
+        :param restartDelay: Initial delay before restarting a worker.
+        :param maxRestartDelay: Upper bound of the restart delay.
+        :param logger: Logger instance.
+        :param clock: Monotonic clock.
+        """
+        self.target = target
+        self.partitions = partitions
+        self.args = tuple(args)
+        self.restart = restart
+        self.stallTimeout = stallTimeout
+        self.restartDelay = float(restartDelay)
+        self.maxRestartDelay = float(maxRestartDelay)
+        self.logger = logger
+        self.clock = clock
+        self.context = multiprocessing.get_context('spawn')
+        self.messages = self.context.Queue()
+        self.workers = {}
+        self.stopped = False
+        self.failed = False
+        self.stats = {}
+        for shard, config in enumerate(partitions):
+            if not config:
+                continue
+            self.stats[shard] = {
+                'devices': len(config),
+                'polled': 0,
+                'failed': 0,
+                'cycles': 0,
+                'duration': 0.0,
+                'duration_avg': 0.0,
+                'duration_max': 0.0,
+                'overruns': 0,
+                'restarts': 0,
+            }
+
+    def IsRunning(self):
+        """
+        :return: True while any worker is alive or due to be restarted.
+        """
+        if any(worker['process'].is_alive() for worker in self.workers.values()):
+            return True
+        return self.restart and not self.stopped and bool(self.workers)
+
+    def Receive(self, timeout=1.0):
+        """
+        Wait for worker messages and return every message available.
+
+        :param timeout: Seconds to wait for the first message.
+        :return: List of messages.
+        """
+        messages = []
+        try:
+            messages.append(self.messages.get(timeout=timeout) if timeout > 0
+                else self.messages.get_nowait())
+            while True:
+                messages.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        for message in messages:
+            if message[0] == 'cycle':
+                self.__Report(message[1], message[2]['stats'])
+        return messages
+
+    def Start(self):
+        for shard in self.stats:
+            self.__Spawn(shard)
+
+    def Stats(self):
+        return {shard: dict(stats) for shard, stats in self.stats.items()}
+
+    def Stop(self):
+        """
+        Stop restarting workers. Running workers are left to finish their
+        cycle; Terminate ends the ones which do not.
+        """
+        self.stopped = True
+
+    def Supervise(self):
+        """
+        Restart workers which exited or stopped reporting. Called
+        periodically by the parent while it receives messages.
+        """
+        now = self.clock()
+        for shard, worker in self.workers.items():
+            process = worker['process']
+            if process.is_alive():
+                if self.stallTimeout and not self.stopped and \
+                        now - worker['reported'] > self.stallTimeout:
+                    if self.logger:
+                        self.logger.warning('Shard {} did not report for {:.0f}s, restarting it'.format(
+                            shard, now - worker['reported']))
+                    process.terminate()
+                continue
+            if worker['exited'] is None:
+                worker['exited'] = now
+                if process.exitcode != 0:
+                    self.failed = True
+                    if self.logger:
+                        self.logger.warning('Shard {} exited with code {}'.format(
+                            shard, process.exitcode))
+                # A worker which ran for a while starts over with the
+                # initial delay.
+                if now - worker['started'] > self.maxRestartDelay:
+                    worker['delay'] = self.restartDelay
+            if self.restart and not self.stopped and now - worker['exited'] >= worker['delay']:
+                self.stats[shard]['restarts'] += 1
+                self.__Spawn(shard, delay=min(worker['delay'] * 2, self.maxRestartDelay))
+
+    def Terminate(self, timeout=5.0):
+        """
+        Wait up to timeout seconds for the workers to exit and terminate
+        the remaining ones. Messages are not drained here, so callers keep
+        receiving until IsRunning is False before calling this.
+        """
+        self.stopped = True
+        deadline = self.clock() + timeout
+        for worker in self.workers.values():
+            worker['process'].join(max(0.0, deadline - self.clock()))
+        for worker in self.workers.values():
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+                worker['process'].join()
+
+    def __Report(self, shard, stats):
+        worker = self.workers.get(shard)
+        if worker is not None:
+            worker['reported'] = self.clock()
+        if not stats.get('polled'):
+            return
+        current = self.stats[shard]
+        current['cycles'] += 1
+        current['polled'] = stats['polled']
+        current['failed'] = stats['failed']
+        current['duration'] = stats['duration']
+        current['duration_avg'] += (stats['duration'] - current['duration_avg']) / current['cycles']
+        current['duration_max'] = max(current['duration_max'], stats['duration'])
+        current['overruns'] = stats.get('overruns', 0)
+
+    def __Spawn(self, shard, delay=None):
+        process = self.context.Process(target=self.target, name='poller-shard-{}'.format(shard),
+            args=(shard, self.partitions[shard], self.messages) + self.args, daemon=True)
+        process.start()
+        now = self.clock()
+        self.workers[shard] = {
+            'process': process,
+            'started': now,
+            'reported': now,
+            'exited': None,
+            'delay': self.restartDelay if delay is None else delay,
+        }
+
+
+def Partition(config, shards):
+    """
+    Split the device configuration into shards by the device address.
+
+    :param config: Mapping of device name to device configuration.
+    :param shards: Number of shards.
+    :return: List with one dictionary per shard, each in configuration order.
+    """
+    partitions = [{} for _ in range(shards)]
+    for name, cfg in config.items():
+        key = '{}:{}'.format(cfg.get('address', name), cfg.get('port', ''))
+        partitions[ShardOf(key, shards)][name] = dict(cfg)
+    return partitions
+
+
+def ShardOf(key, shards):
+    """
+    Pick the shard of a key with rendezvous hashing. Changing the number of
+    shards only moves the keys of the shards which were added or removed.
+
+    :param key: Device key, usually its address.
+    :param shards: Number of shards.
+    :return: Shard index.
+    """
+    return max(range(shards), key=lambda shard: hashlib.sha1(
+        '{}/{}'.format(shard, key).encode()).digest())
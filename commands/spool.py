@@ -0,0 +1,366 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from monitor.lib import ConversionFailure, Metric
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+
+
+class Spool(object):
+    """
+    Append-only, disk-backed queue of records split into numbered segment
+    files. Each record is framed with its length and CRC32 so a torn write
+    at the tail is detected and ignored. Segments are read through mmap so
+    a large backlog does not have to fit in memory. The read position is
+    kept in a cursor file and fully consumed segments are deleted.
+
+    Writes are flushed on every append and fsynced at most once per sync
+    interval. Once the spool exceeds its size cap the oldest segments are
+    dropped.
+    """
+
+    def __init__(self, path, segmentSize=4 * 1024 * 1024, maxSize=256 * 1024 * 1024,
+            syncInterval=1.0, logger=None, clock=time.monotonic):
+        self.path = path
+        self.segmentSize = int(segmentSize)
+        self.maxSize = int(maxSize)
+        self.syncInterval = float(syncInterval)
+        self.logger = logger
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.handle = None
+        self.synced = clock()
+        self.dirty = False
+        self.droppedBytes = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        if not self.segments:
+            self.segments.append(1)
+        self.cursor = self.__LoadCursor()
+        # Always append to a new segment so a tail torn by a crash is never
+        # followed by new records.
+        last = self.segments[-1]
+        if os.path.exists(self.__GetPath(last)) and os.path.getsize(self.__GetPath(last)):
+            last += 1
+        self.__Open(last)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Append(self, payload):
+        """
+        :param payload: Record bytes.
+        """
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.handle.tell() + len(record) > self.segmentSize and self.handle.tell() > 0:
+                self.__Rotate()
+            self.handle.write(record)
+            self.handle.flush()
+            self.dirty = True
+            if self.clock() - self.synced >= self.syncInterval:
+                self.Sync()
+
+    def Close(self):
+        with self.lock:
+            if self.handle is not None:
+                self.Sync()
+                self.handle.close()
+                self.handle = None
+
+    def Commit(self, position):
+        """
+        Advance the cursor past the records read up to position and delete
+        the segments before it.
+
+        :param position: Tuple of (segment, offset) returned by Read.
+        """
+        with self.lock:
+            self.cursor = position
+            for segment in [segment for segment in self.segments if segment < position[0]]:
+                self.__Remove(segment)
+            temporary = os.path.join(self.path, 'cursor.tmp')
+            with open(temporary, 'w') as handle:
+                json.dump({'segment': position[0], 'offset': position[1]}, handle)
+            os.replace(temporary, os.path.join(self.path, 'cursor'))
+
+    def IsEmpty(self):
+        with self.lock:
+            return self.cursor == (self.segments[-1], self.handle.tell())
+
+    def Read(self, limit=1000):
+        """
+        Read records from the cursor without consuming them.
+
+        :param limit: Maximum number of records.
+        :return: Tuple of (records, position). Records are (payload,
+            position) tuples where position is passed to Commit once every
+            record up to it was processed.
+        """
+        records = []
+        with self.lock:
+            segment, offset = self.cursor
+            current = segment
+            for current in [current for current in self.segments if current >= segment]:
+                if current != segment:
+                    offset = 0
+                active = current == self.segments[-1]
+                if os.path.getsize(self.__GetPath(current)) > offset:
+                    with open(self.__GetPath(current), 'rb') as handle, \
+                            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                        offset = self.__ReadRecords(view, current, offset, active,
+                            limit - len(records), records)
+                if len(records) >= limit:
+                    break
+            return records, (current, offset)
+
+    def Size(self):
+        with self.lock:
+            return sum(os.path.getsize(self.__GetPath(segment)) for segment in self.segments)
+
+    def Sync(self):
+        with self.lock:
+            if self.dirty and self.handle is not None:
+                os.fsync(self.handle.fileno())
+                self.dirty = False
+            self.synced = self.clock()
+
+    def __GetPath(self, segment):
+        return os.path.join(self.path, '{:012d}{}'.format(segment, SEGMENT_SUFFIX))
+
+    def __LoadCursor(self):
+        try:
+            with open(os.path.join(self.path, 'cursor'), 'r') as handle:
+                data = json.load(handle)
+            cursor = (int(data['segment']), int(data['offset']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return (self.segments[0], 0)
+        if cursor[0] < self.segments[0]:
+            return (self.segments[0], 0)
+        return cursor
+
+    def __Open(self, segment):
+        if segment not in self.segments:
+            self.segments.append(segment)
+        self.handle = open(self.__GetPath(segment), 'ab')
+
+    @staticmethod
+    def __ReadRecords(view, segment, offset, active, limit, records):
+        # A short or corrupt record ends the segment. On the active segment
+        # a short record is a write in progress; on older segments it is a
+        # tail torn by a crash, which is skipped with the rest of the segment.
+        end = len(view)
+        while len(records) < limit and offset + HEADER.size <= end:
+            length, checksum = HEADER.unpack_from(view, offset)
+            start = offset + HEADER.size
+            if start + length > end:
+                return offset if active else end
+            payload = view[start:start + length]
+            if zlib.crc32(payload) != checksum:
+                return offset if active else end
+            offset = start + length
+            records.append((payload, (segment, offset)))
+        if offset < end and offset + HEADER.size > end and not active:
+            return end
+        return offset
+
+    def __Remove(self, segment):
+        try:
+            os.remove(self.__GetPath(segment))
+        except FileNotFoundError:
+            pass
+        self.segments.remove(segment)
+
+    def __Rotate(self):
+        self.Sync()
+        self.handle.close()
+        self.__Open(self.segments[-1] + 1)
+        while len(self.segments) > 1 and self.Size() > self.maxSize:
+            oldest = self.segments[0]
+            self.droppedBytes += os.path.getsize(self.__GetPath(oldest))
+            if self.logger:
+                self.logger.warning('Spool exceeds {} bytes, dropping segment {}'.format(
+                    self.maxSize, oldest))
+            self.__Remove(oldest)
+            if self.cursor[0] <= oldest:
+                self.cursor = (self.segments[0], 0)
+
+
+class SpoolingPipeline(object):
+    """
+    Metric sink wrapper which spools metrics to disk when the sink fails.
+    While a backlog exists new metrics are appended to the spool as well so
+    the sink receives them in order. The backlog is replayed in batches by
+    Drain, either from a background thread or by the caller.
+
+    With a batch sink, Submit takes whole batches instead and the backlog is
+    replayed through the batch sink, one batch per spool read.
+    """
+
+    def __init__(self, pipeline, spool, logger=None, batch=500, batchSink=None):
+        self.pipeline = pipeline
+        self.batchSink = batchSink
+        self.spool = spool
+        self.logger = logger
+        self.batch = int(batch)
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+        self.stopped = False
+        self.spooled = 0
+        self.replayed = 0
+
+    def __call__(self, metric):
+        with self.lock:
+            if self.spool.IsEmpty():
+                try:
+                    self.pipeline(metric)
+                    return
+                except ConversionFailure:
+                    raise
+                except Exception as e:
+                    if self.logger:
+                        self.logger.warning('Metric sink failed, spooling metrics: {}'.format(e))
+            self.spool.Append(Serialize(metric))
+            self.spooled += 1
+        self.event.set()
+
+    def Drain(self):
+        """
+        Replay spooled metrics until the spool is empty or the sink fails.
+
+        :return: Number of metrics replayed.
+        """
+        replayed = 0
+        while True:
+            with self.lock:
+                records, position = self.spool.Read(self.batch)
+                if not records:
+                    # Moves the cursor past empty or torn segment tails.
+                    self.spool.Commit(position)
+                    return replayed
+                if self.batchSink is not None:
+                    metrics = [Deserialize(payload) for payload, _ in records]
+                    try:
+                        self.batchSink([(metric, int(metric.timestamp * 1e9)) for metric in metrics])
+                    except Exception as e:
+                        if self.logger:
+                            self.logger.debug('Batch sink still failing: {}'.format(e))
+                        return replayed
+                    self.spool.Commit(position)
+                    replayed += len(records)
+                    self.replayed += len(records)
+                    continue
+                committed = None
+                for payload, position in records:
+                    try:
+                        self.pipeline(Deserialize(payload))
+                    except ConversionFailure:
+                        pass
+                    except Exception as e:
+                        if self.logger:
+                            self.logger.debug('Metric sink still failing: {}'.format(e))
+                        if committed is not None:
+                            self.spool.Commit(committed)
+                        return replayed
+                    committed = position
+                    replayed += 1
+                    self.replayed += 1
+                self.spool.Commit(committed)
+
+    def Start(self, interval=5.0):
+        """
+        Drain the spool from a background thread, retrying every interval
+        seconds while the sink is failing.
+        """
+        def Run():
+            while not self.stopped:
+                self.event.wait(interval)
+                self.event.clear()
+                if not self.stopped and not self.spool.IsEmpty():
+                    count = self.Drain()
+                    if count and self.logger:
+                        self.logger.info('Replayed {} spooled metrics'.format(count))
+
+        if self.thread is None:
+            self.event.set()
+            self.thread = threading.Thread(target=Run, name='spool-drain', daemon=True)
+            self.thread.start()
+
+    def Stop(self):
+        self.stopped = True
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.spool.Sync()
+
+    def Submit(self, batch):
+        """
+        Batch sink counterpart of calling the pipeline. Hands the batch to
+        the batch sink, or spools it when the sink fails or a backlog exists.
+
+        :param batch: List of (metric, timestamp) tuples, timestamps in
+            nanoseconds.
+        """
+        with self.lock:
+            if self.spool.IsEmpty():
+                try:
+                    self.batchSink(batch)
+                    return
+                except Exception as e:
+                    if self.logger:
+                        self.logger.warning('Batch sink failed, spooling {} metrics: {}'.format(
+                            len(batch), e))
+            for metric, timestamp in batch:
+                self.spool.Append(Serialize(metric, timestamp / 1e9))
+            self.spooled += len(batch)
+        self.event.set()
+
+
+def Deserialize(payload):
+    data = json.loads(payload)
+    metric = Metric(data['name'], data['measurement'], tags=data['tags'])
+    for key, value in data['fields'].items():
+        metric.AddField(key, value)
+    if data.get('timestamp') is not None:
+        metric.timestamp = data['timestamp']
+    return metric
+
+
+def Serialize(metric, timestamp=None):
+    # Metrics without their own timestamp are stamped when spooled so a
+    # replay does not move them to the replay time.
+    if timestamp is None:
+        timestamp = getattr(metric, 'timestamp', None)
+    return json.dumps({
+        'name': metric.name,
+        'measurement': metric.measurement,
+        'tags': metric.tags,
+        'fields': metric.fields,
+        'timestamp': timestamp if timestamp is not None else time.time(),
+    }, separators=(',', ':')).encode()
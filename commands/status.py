@@ -12,9 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
 from monitor.lib import ConfigError
-from tplink.discover import LoadDevice
+from tplink.devices import Device, EmeterHandler
+from tplink.discover import LoadDevice, Registry
+from tplink.exceptions import DeviceError
+from tplink.pool import ConnectionPool
+from tplink.series import SeriesStore
 from tplink.utils import IsValidIPv4
+import json
+import time
+
+
+TABLE_COLUMNS = (('Name', 'name'), ('Address', 'address'), ('Alias', 'alias'),
+    ('Model', 'model'), ('State', 'state'), ('Power (W)', 'power'),
+    ('Today (Wh)', 'today'), ('Uptime', 'uptime'), ('WiFi', 'rssi'))
+TREND_WINDOWS = (('5 minutes', 300), ('1 hour', 3600), ('24 hours', 86400))
 
 
 def PrettyDuration(seconds, values=2):
@@ -65,73 +78,235 @@ def Status(config, args):
         print('Failed to load config: {}'.format(e))
         return False
 
-    devices = []
-    for [name, cfg] in config.GetRoot().items():
-        device = LoadDevice(cfg['address'])
-        if device is None:
-            print('Failed to load device: {}'.format(name))
-            continue
-        devices.append(device)
-    if args.devices:
-        for address in args.devices:
-            if not IsValidIPv4(address):
-                print('Invalid IPv4 Address: {}'.format(address))
-                continue
-            device = LoadDevice(address)
-            if device is None:
-                print('Failed to load device: {}'.format(address))
-                continue
-            devices.append(device)
-    if not devices:
-        print('Failed to load any devices')
-        return False
+    pool = ConnectionPool() if args.keepalive else None
+    registry = None
+    if args.registry:
+        registry = Registry(args.registry)
+        registry.Load()
+    try:
+        return ShowStatus(config, args, pool, registry)
+    finally:
+        if registry is not None:
+            registry.Save()
+        if pool is not None:
+            pool.Close()
 
-    for device in devices:
-        print('-' * 30)
-        print('Device Information')
-        print('\tAddress: {}'.format(device.address))
-        print('\tAlias: {}'.format(device.GetAlias()))
-        print('\tDevice Type: {} ({})'.format(device.GetType(), device.GetTypeString()))
-        print('\tDevice Model: {}'.format(device.GetModel()))
-        print('\tDevice Identifier: {}'.format(device.GetDeviceIdentifier()))
-        print('\tDescription: {}'.format(device.GetDescription()))
-        print()
 
-        print('Device State')
-        print('\tUptime: {}'.format(PrettyDuration(device.GetUptime())))
-        print('\tState: {}'.format('On' if device.IsOn() else 'Off'))
+def CollectStatus(target, queries, pool=None, registry=None, history=None):
+    """
+    Query the state of a single device and gather it into a status record.
+    Every value is read while the device is loaded so rendering does not
+    touch the network.
+
+    :param target: Tuple of (name, address, port).
+    :param queries: Queries batched with the sysinfo request.
+    :param pool: Optional connection pool.
+    :param registry: Optional device registry.
+    :param history: Optional SeriesStore with the recent readings.
+    :return: Dictionary describing the device. Devices which could not be
+        queried carry an 'error' message.
+    """
+    name, address, port = target
+    record = {'name': name, 'address': address, 'port': port, 'error': None}
+    try:
+        device = LoadDevice(address, port=port, pool=pool, queries=queries,
+            registry=registry)
+        if device is None:
+            record['error'] = 'Failed to load device'
+            return record
+
+        record.update({
+            'alias': device.GetAlias(),
+            'type': device.GetType(),
+            'type_string': device.GetTypeString(),
+            'model': device.GetModel(),
+            'device_id': device.GetDeviceIdentifier(),
+            'description': device.GetDescription(),
+            'uptime': device.GetUptime(),
+            'on': device.IsOn(),
+            'led': device.IsLedOn() if device.IsPlug() else None,
+            'software_version': device.GetSoftwareVersion(),
+            'hardware_version': device.GetHardwareVersion(),
+            'mac': device.GetMacAddress(),
+            'rssi': device.GetSignalStrength(),
+            'light': None,
+            'emeter': None,
+            'trend': None,
+        })
 
-        if device.IsPlug():
-            print('\tLED: {}'.format('On' if device.IsLedOn() else 'Off'))
         if device.IsBulb():
-            print('\tColor Supported: {}'.format('Yes' if device.IsColorSupported() else 'No'))
-            print('\tBrightness Supported: {}'.format('Yes' if device.IsBrightnessSupported() else 'No'))
+            light = record['light'] = {
+                'color_supported': device.IsColorSupported(),
+                'brightness_supported': device.IsBrightnessSupported(),
+            }
             if device.IsColorSupported() and device.IsOn():
-                print('\tHue: {}'.format(device.GetHue()))
-                print('\tSaturation: {}'.format(device.GetSaturation()))
-                print('\tBrightness: {}'.format(device.GetBrightness()))
-                print('\tTemperature: {}'.format(device.GetTemperature()))
-        print()
+                light.update({
+                    'hue': device.GetHue(),
+                    'saturation': device.GetSaturation(),
+                    'brightness': device.GetBrightness(),
+                    'temperature': device.GetTemperature(),
+                })
 
         if device.HasEmeter():
-            print('Electricity Meter')
             emeter = device.GetEmeter()
-            print('\tAmperage: {} amps'.format(emeter.GetAmps()))
-            print('\tConsumption: {} watts'.format(emeter.GetConsumption()))
-            print('\tVoltage: {} volts'.format(emeter.GetVoltage()))
-            print('\tDaily Usage (kW/H): {}'.format(emeter.GetUsageToday()))
-            print('\tAverage Daily Usage (kW/H): {}'.format(emeter.GetDailyAverage()))
-            print('\tMonthly Usage (kW/H): {}'.format(emeter.GetUsageMonth()))
-            print('\tAverage Monthly Usage (kW/H): {}'.format(emeter.GetMonthlyAverage()))
-            print()
-
-        print('Version Information')
-        print('\tSoftware Version: {}'.format(device.GetSoftwareVersion()))
-        print('\tHardware Version: {}'.format(device.GetHardwareVersion()))
+            sample = emeter.GetSample()
+            record['emeter'] = {
+                'current': sample.current or 0,
+                'power': sample.power,
+                'voltage': sample.voltage,
+                'today': emeter.GetUsageToday(),
+                'daily_average': emeter.GetDailyAverage(),
+                'month': emeter.GetUsageMonth(),
+                'monthly_average': emeter.GetMonthlyAverage(),
+            }
+    except DeviceError as e:
+        record['error'] = e.message
+        return record
+
+    series = history.Get(name) if history is not None else None
+    if series is not None:
+        record['trend'] = {label: series.Summary('power', seconds)
+            for (label, seconds) in TREND_WINDOWS}
+    return record
+
+
+def PrintDetails(record):
+    print('-' * 30)
+    if record['error'] is not None:
+        print('Failed to load device: {} ({})'.format(record['name'], record['error']))
+        return
+
+    print('Device Information')
+    print('\tAddress: {}'.format(record['address']))
+    print('\tAlias: {}'.format(record['alias']))
+    print('\tDevice Type: {} ({})'.format(record['type'], record['type_string']))
+    print('\tDevice Model: {}'.format(record['model']))
+    print('\tDevice Identifier: {}'.format(record['device_id']))
+    print('\tDescription: {}'.format(record['description']))
+    print()
+
+    print('Device State')
+    print('\tUptime: {}'.format(PrettyDuration(record['uptime'])))
+    print('\tState: {}'.format('On' if record['on'] else 'Off'))
+
+    if record['led'] is not None:
+        print('\tLED: {}'.format('On' if record['led'] else 'Off'))
+    light = record['light']
+    if light is not None:
+        print('\tColor Supported: {}'.format('Yes' if light['color_supported'] else 'No'))
+        print('\tBrightness Supported: {}'.format('Yes' if light['brightness_supported'] else 'No'))
+        if 'hue' in light:
+            print('\tHue: {}'.format(light['hue']))
+            print('\tSaturation: {}'.format(light['saturation']))
+            print('\tBrightness: {}'.format(light['brightness']))
+            print('\tTemperature: {}'.format(light['temperature']))
+    print()
+
+    emeter = record['emeter']
+    if emeter is not None:
+        print('Electricity Meter')
+        print('\tAmperage: {} amps'.format(emeter['current']))
+        print('\tConsumption: {} watts'.format(emeter['power']))
+        print('\tVoltage: {} volts'.format(emeter['voltage']))
+        print('\tDaily Usage (Wh): {}'.format(emeter['today']))
+        print('\tAverage Daily Usage (Wh): {}'.format(emeter['daily_average']))
+        print('\tMonthly Usage (Wh): {}'.format(emeter['month']))
+        print('\tAverage Monthly Usage (Wh): {}'.format(emeter['monthly_average']))
         print()
 
-        print('Network Status')
-        print('\tMAC Address: {}'.format(device.GetMacAddress()))
-        strength = device.GetSignalStrength()
-        print('\tWiFi Strength: {} ({})'.format(SignalStrength(strength), strength))
+    if record['trend'] is not None:
+        print('Recent Trend')
+        for (label, _) in TREND_WINDOWS:
+            summary = record['trend'][label]
+            if summary is None:
+                continue
+            print('\tPower ({}): min {:.1f} / mean {:.1f} / p90 {:.1f} / max {:.1f} watts'.format(
+                label, summary['min'], summary['mean'], summary['p90'], summary['max']))
         print()
+
+    print('Version Information')
+    print('\tSoftware Version: {}'.format(record['software_version']))
+    print('\tHardware Version: {}'.format(record['hardware_version']))
+    print()
+
+    print('Network Status')
+    print('\tMAC Address: {}'.format(record['mac']))
+    print('\tWiFi Strength: {} ({})'.format(SignalStrength(record['rssi']), record['rssi']))
+    print()
+
+
+def PrintTable(records):
+    rows = [[title for (title, _) in TABLE_COLUMNS]]
+    for record in records:
+        if record['error'] is not None:
+            rows.append([record['name'], record['address'], 'ERROR: {}'.format(record['error'])])
+            continue
+        emeter = record['emeter'] or {}
+        values = {
+            'name': record['name'],
+            'address': record['address'],
+            'alias': record['alias'],
+            'model': record['model'],
+            'state': 'On' if record['on'] else 'Off',
+            'power': '{:.1f}'.format(emeter['power']) if emeter.get('power') is not None else '-',
+            'today': emeter.get('today', '-'),
+            'uptime': PrettyDuration(record['uptime'], values=1),
+            'rssi': record['rssi'],
+        }
+        rows.append([str(values[key]) for (_, key) in TABLE_COLUMNS])
+
+    # Error rows span the remaining columns and do not widen them.
+    widths = [max(len(row[index]) for row in rows if len(row) == len(TABLE_COLUMNS))
+        for index in range(len(TABLE_COLUMNS))]
+    for row in rows:
+        cells = [value.ljust(width) for value, width in zip(row[:-1], widths)]
+        print('  '.join(cells + [row[-1]]).rstrip())
+
+
+def ShowStatus(config, args, pool=None, registry=None):
+    """
+    Query every device concurrently and print the results once all of them
+    answered, as a detailed report, a table or JSON.
+    """
+    targets = []
+    for [name, cfg] in config.GetRoot().items():
+        targets.append((name, cfg['address'], int(cfg.get('port', Device.DEFAULT_PORT))))
+    for address in args.devices or []:
+        if not IsValidIPv4(address):
+            print('Invalid IPv4 Address: {}'.format(address))
+            continue
+        targets.append((address, address, Device.DEFAULT_PORT))
+    if not targets:
+        print('Failed to load any devices')
+        return False
+
+    history = None
+    if args.history:
+        history = SeriesStore(0)
+        if not history.Load(args.history):
+            print('Failed to load history: {}'.format(args.history))
+            history = None
+
+    queries = [('system', 'get_sysinfo', None)] + EmeterHandler.StatisticsQueries()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(args.concurrency, len(targets))),
+            thread_name_prefix='status') as executor:
+        records = list(executor.map(lambda target: CollectStatus(target, queries,
+            pool=pool, registry=registry, history=history), targets))
+    elapsed = time.monotonic() - start
+
+    if args.json:
+        print(json.dumps(records, indent=2))
+    elif args.table:
+        PrintTable(records)
+        print()
+        print('Queried {} devices in {:.2f}s'.format(len(records), elapsed))
+    else:
+        for record in records:
+            PrintDetails(record)
+
+    if all(record['error'] is not None for record in records):
+        if not args.json:
+            print('Failed to load any devices')
+        return False
+    return True
@@ -0,0 +1,100 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import threading
+import time
+
+
+class BreakerState(object):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    NAMES = {CLOSED: 'closed', HALF_OPEN: 'half-open', OPEN: 'open'}
+
+
+class CircuitBreaker(object):
+    """
+    Per-device circuit breaker. After a number of consecutive failures the
+    breaker opens and requests are skipped until the retry time. The first
+    request after that is a probe (half-open); success closes the breaker
+    and failure opens it again with an exponentially longer, jittered delay.
+    A probe which is never resolved expires after the probe timeout, after
+    which the next request is allowed as a new probe.
+    """
+
+    def __init__(self, threshold=3, delay=30.0, maxDelay=600.0, jitter=0.2,
+            probeTimeout=60.0, clock=time.monotonic, random=random.random):
+        self.threshold = max(1, int(threshold))
+        self.baseDelay = float(delay)
+        self.maxDelay = max(float(maxDelay), self.baseDelay)
+        self.jitter = float(jitter)
+        self.probeTimeout = float(probeTimeout)
+        self.clock = clock
+        self.random = random
+        self.lock = threading.Lock()
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.delay = self.baseDelay
+        self.retryAt = 0.0
+        self.probeExpires = 0.0
+
+    def Allow(self):
+        """
+        Check whether a request may be sent. An open breaker whose retry
+        time passed moves to half-open and allows a single probe.
+
+        :return: True if the request should be sent.
+        """
+        with self.lock:
+            if self.state == BreakerState.CLOSED:
+                return True
+            now = self.clock()
+            if self.state == BreakerState.HALF_OPEN and now >= self.probeExpires:
+                self.state = BreakerState.OPEN
+            if self.state == BreakerState.OPEN and now >= self.retryAt:
+                self.state = BreakerState.HALF_OPEN
+                self.probeExpires = now + self.probeTimeout
+                return True
+            return False
+
+    def GetStateName(self):
+        return BreakerState.NAMES[self.state]
+
+    def IsClosed(self):
+        return self.state == BreakerState.CLOSED
+
+    def IsProbing(self):
+        return self.state == BreakerState.HALF_OPEN
+
+    def RecordFailure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == BreakerState.HALF_OPEN:
+                self.delay = min(self.delay * 2, self.maxDelay)
+            elif self.state == BreakerState.CLOSED and self.failures >= self.threshold:
+                self.delay = self.baseDelay
+            else:
+                return
+            self.state = BreakerState.OPEN
+            spread = 1.0 + self.jitter * (2 * self.random() - 1)
+            self.retryAt = self.clock() + self.delay * spread
+
+    def RecordSuccess(self):
+        with self.lock:
+            self.state = BreakerState.CLOSED
+            self.failures = 0
+            self.delay = self.baseDelay
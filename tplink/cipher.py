@@ -0,0 +1,145 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Backends for the XOR autokey cipher used by the TP-Link protocol.
+
+Each ciphertext byte is the plaintext byte XORed with the previous
+ciphertext byte, seeded with the key. Encryption is therefore a prefix XOR
+over the plaintext and decryption XORs the ciphertext with itself shifted
+by one byte, both of which can be computed without a Python level loop.
+
+The fastest available backend is selected at import time:
+
+* numpy   - vectorized prefix XOR, used when NumPy is installed.
+* integer - arbitrary precision integer arithmetic from the standard library.
+* python  - the reference byte-by-byte loop.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this size the cost of converting to and from arrays outweighs the
+# vectorized work and the integer backend is faster.
+NUMPY_THRESHOLD = 1024
+
+
+def PythonDecrypt(data, key):
+    buffer = bytearray()
+    for cipherbyte in data:
+        buffer.append(key ^ cipherbyte)
+        key = cipherbyte
+    return bytes(buffer)
+
+
+def PythonEncrypt(data, key):
+    buffer = bytearray()
+    for plainbyte in data:
+        key ^= plainbyte
+        buffer.append(key)
+    return bytes(buffer)
+
+
+def IntegerDecrypt(data, key):
+    length = len(data)
+    if length == 0:
+        return b''
+    value = int.from_bytes(data, 'big')
+    previous = (value >> 8) | (key << (8 * (length - 1)))
+    return (value ^ previous).to_bytes(length, 'big')
+
+
+def IntegerEncrypt(data, key):
+    length = len(data)
+    if length == 0:
+        return b''
+    # Fold the key into the first byte then compute the prefix XOR with
+    # log2(n) shift-and-xor passes over the whole message.
+    value = int.from_bytes(data, 'big') ^ (key << (8 * (length - 1)))
+    shift = 8
+    while shift < 8 * length:
+        value ^= value >> shift
+        shift <<= 1
+    return value.to_bytes(length, 'big')
+
+
+def NumpyDecrypt(data, key):
+    if len(data) < NUMPY_THRESHOLD:
+        return IntegerDecrypt(data, key)
+    cipher = numpy.frombuffer(data, dtype=numpy.uint8)
+    previous = numpy.empty_like(cipher)
+    previous[0] = key
+    previous[1:] = cipher[:-1]
+    return numpy.bitwise_xor(cipher, previous).tobytes()
+
+
+def NumpyEncrypt(data, key):
+    if len(data) < NUMPY_THRESHOLD:
+        return IntegerEncrypt(data, key)
+    plain = numpy.frombuffer(data, dtype=numpy.uint8).copy()
+    plain[0] ^= key
+    return numpy.bitwise_xor.accumulate(plain).tobytes()
+
+
+BACKENDS = {
+    'python': (PythonEncrypt, PythonDecrypt),
+    'integer': (IntegerEncrypt, IntegerDecrypt),
+}
+if numpy is not None:
+    BACKENDS['numpy'] = (NumpyEncrypt, NumpyDecrypt)
+
+backend = None
+Encrypt = None
+Decrypt = None
+
+
+class Decryptor(object):
+    """
+    Incremental decryption for data arriving in chunks. The autokey only
+    depends on the previous ciphertext byte, so it is carried between calls.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def Update(self, data):
+        if len(data) == 0:
+            return b''
+        plaintext = Decrypt(data, self.key)
+        self.key = data[-1]
+        return plaintext
+
+
+def GetBackend():
+    return backend
+
+
+def SetBackend(name):
+    """
+    Select the cipher backend used by Encrypt and Decrypt.
+
+    :param name: One of the names in BACKENDS.
+    :return: None
+    """
+    global backend, Encrypt, Decrypt
+    if name not in BACKENDS:
+        raise ValueError("Unknown cipher backend '{}'".format(name))
+    backend = name
+    Encrypt, Decrypt = BACKENDS[name]
+
+
+SetBackend('numpy' if numpy is not None else 'integer')
@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .aio import AsyncDevice, AsyncEmeterHandler
 from .bulb import Bulb
 from .device import Device, DeviceType
+from .emeter import EmeterHandler
 from .lightstrip import LightStrip
 from .plug import Plug
+from .sample import RealtimeSample
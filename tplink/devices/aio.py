@@ -0,0 +1,213 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import errno
+import struct
+import time
+from ..exceptions import DeviceError
+from ..framing import MAX_FRAME_SIZE
+
+
+class AsyncDevice(object):
+    """
+    Asyncio front-end for a device. The wrapped device instance keeps the
+    protocol and device specific logic (query construction, response
+    handling and caching) while this class only replaces the blocking
+    transport with asyncio streams. Writes are reconciled on the event
+    loop rather than from a timer thread.
+    """
+
+    def __init__(self, device, timeout=None):
+        self.device = device
+        self.timeout = timeout or device.timeout
+        self.emeter = None
+        self.reconcileQueries = set()
+        self.reconcileHandle = None
+        self.reconcileTask = None
+
+    def __repr__(self):
+        return '<Async{}'.format(repr(self.device)[1:])
+
+    @property
+    def address(self):
+        return self.device.address
+
+    @property
+    def port(self):
+        return self.device.port
+
+    async def GetAlias(self):
+        return await self.GetSysInfo('alias')
+
+    async def GetEmeter(self):
+        # Feature detection reads the sysinfo so make sure it is cached
+        # before handing off to the synchronous device logic.
+        await self.GetInfo()
+        if self.emeter is None:
+            self.emeter = AsyncEmeterHandler(self, self.device.GetEmeter())
+        return self.emeter
+
+    async def GetInfo(self, key=None):
+        info = self.device.cache.Get('system')
+        if info is None:
+            info = await self.Send(
+                self.device.QueryHelper('system', 'get_sysinfo'))
+        return self.device.HandleInfo(info, key)
+
+    async def GetRealtime(self, key=None, cache=True):
+        emeter = await self.GetEmeter()
+        return await emeter.GetRealtime(key=key, cache=cache)
+
+    async def GetSample(self, cache=True):
+        emeter = await self.GetEmeter()
+        return await emeter.GetSample(cache=cache)
+
+    async def GetSysInfo(self, key=None):
+        info = await self.GetInfo('system')
+        if key is not None:
+            return info['get_sysinfo'].get(key)
+        return info['get_sysinfo']
+
+    async def Off(self):
+        return await self.SetState(0)
+
+    async def On(self):
+        return await self.SetState(1)
+
+    async def Reconcile(self):
+        """
+        Asyncio counterpart of Device.Reconcile.
+        """
+        queries = sorted(self.reconcileQueries)
+        self.reconcileQueries = set()
+        self.reconcileHandle = None
+        if not queries:
+            return
+        device = self.device
+        writes = device.writes
+        batch = [(target, command, None) for (target, command) in queries]
+        try:
+            device.HandleBatch(batch, await self.Send(device.BatchQueryHelper(batch)))
+        except DeviceError as e:
+            if device.logger:
+                device.logger.debug("Failed to reconcile '{}': {}".format(device.address, e.message))
+            for (target, _) in queries:
+                device.cache.Invalidate(target)
+            return
+        if device.writes != writes:
+            for (target, command) in queries:
+                self.ScheduleReconcile(target, command)
+
+    def ScheduleReconcile(self, target, command):
+        """
+        Queue a read query for a reconcile scheduled on the running loop.
+        """
+        delay = self.device.reconcileDelay
+        if not delay or delay <= 0:
+            self.device.cache.Invalidate(target)
+            return
+        self.reconcileQueries.add((target, command))
+        if self.reconcileHandle is None:
+            loop = asyncio.get_running_loop()
+
+            def Run():
+                self.reconcileTask = loop.create_task(self.Reconcile())
+            self.reconcileHandle = loop.call_later(delay, Run)
+
+    async def Send(self, message):
+        device = self.device
+        encrypted = device.Encrypt(message, device.key)
+
+        latency = device.latency
+        writer = None
+        try:
+            start = time.perf_counter()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(device.address, device.port),
+                min(device.connectTimeout, self.timeout))
+            if latency is not None:
+                latency.Record('connect', time.perf_counter() - start)
+            writer.write(encrypted)
+            await writer.drain()
+
+            start = time.perf_counter()
+            header = await asyncio.wait_for(reader.readexactly(4), self.timeout)
+            firstByte = time.perf_counter()
+            length = struct.unpack('>I', header)[0]
+            if length > MAX_FRAME_SIZE:
+                raise OSError(errno.EMSGSIZE, 'Frame of {} bytes exceeds the {} byte limit'.format(
+                    length, MAX_FRAME_SIZE))
+            payload = await asyncio.wait_for(reader.readexactly(length), self.timeout)
+            if latency is not None:
+                latency.Record('ttfb', firstByte - start)
+                latency.Record('transfer', time.perf_counter() - firstByte)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            err = getattr(e, 'errno', None)
+            if device.logger:
+                device.logger.warning('Error connecting to: {} ({})'.format(
+                    device.address, e or type(e).__name__))
+            raise device.ConnectionFailure(err)
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+        return device.ParseResponse(payload)
+
+    async def SetState(self, state):
+        """
+        :return: True if the device accepted the command, like Device.Set.
+        """
+        target, command, argument = self.device.StateQuery(state)
+        response = await self.Send(self.device.QueryHelper(target, command, argument))
+        result = (response or {}).get(target, {}).get(command, {})
+        if not isinstance(result, dict) or result.get('err_code') != 0:
+            return False
+        target, command, values = self.device.StateEffect(state)
+        self.device.ApplyState(target, command, values, reconcile=False)
+        self.ScheduleReconcile(target, command)
+        return True
+
+
+class AsyncEmeterHandler(object):
+    """
+    Asyncio counterpart of EmeterHandler sharing its cache and response
+    processing.
+    """
+
+    def __init__(self, device, handler):
+        self.device = device
+        self.handler = handler
+
+    async def GetRealtime(self, key=None, cache=True):
+        sample = await self.GetSample(cache)
+        if key is not None:
+            return sample.Get(key)
+        return sample.AsDict()
+
+    async def GetSample(self, cache=True):
+        sample = None
+        if cache:
+            sample = self.handler.GetCachedRealtime()
+        if sample is None:
+            emeterType = self.handler.emeterType
+            response = await self.device.Send(
+                self.handler.QueryHelper(emeterType, 'get_realtime'))
+            sample = self.handler.HandleRealtime(response[emeterType]['get_realtime'])
+        return sample
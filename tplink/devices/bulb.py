@@ -29,10 +29,7 @@ class Bulb(Device):
     def GetBrightness(self):
         if not self.IsColorSupported():
             raise DeviceError('Color changes are not supported')
-        info = self.GetLightState()
-        if self.IsOn():
-            return int(info['dft_on_state']['brightness'])
-        return int(info.get('brightness', 0))
+        return int(self.__GetLightValue('brightness'))
 
     def GetEmeterType(self):
         if not self.HasEmeter():
@@ -42,18 +39,17 @@ class Bulb(Device):
     def GetHue(self):
         if not self.IsColorSupported():
             raise DeviceError('Color changes are not supported')
-        info = self.GetLightState()
-        if self.IsOn():
-            return int(info['dft_on_state']['hue'])
-        return int(info.get('hue', 0))
+        return int(self.__GetLightValue('hue'))
 
     def GetLightState(self, key=None):
-        info = self.cache.Get(self.LIGHT_STATE)
-        if info is None:
-            info = self.Send(
+        # Cached in the same shape as batched responses stored by
+        # HandleResult: {LIGHT_STATE: {'get_light_state': state}}.
+        response = self.cache.Get(self.LIGHT_STATE)
+        if response is None:
+            response = self.Send(
                 self.QueryHelper(self.LIGHT_STATE, 'get_light_state'))
-        if info is not None:
-            self.cache.Insert(self.LIGHT_STATE, info)
+            self.cache.Insert(self.LIGHT_STATE, response)
+        info = response[self.LIGHT_STATE]['get_light_state']
         if key is not None:
             return info.get(key)
         return info
@@ -61,18 +57,19 @@ class Bulb(Device):
     def GetSaturation(self):
         if not self.IsColorSupported():
             raise DeviceError('Color changes are not supported')
-        info = self.GetLightState()
-        if self.IsOn():
-            return int(info['dft_on_state']['saturation'])
-        return int(info.get('saturation', 0))
+        return int(self.__GetLightValue('saturation'))
 
     def GetTemperature(self):
         if not self.IsTempSupported():
             raise DeviceError('Color changes are not supported')
-        info = self.GetLightState()
-        if self.IsOn():
-            return int(info['dft_on_state']['color_temp'])
-        return int(info.get('color_temp', 0))
+        return int(self.__GetLightValue('color_temp'))
+
+    def HandleResult(self, target, command, argument, result):
+        if target == self.LIGHT_STATE and command == 'get_light_state':
+            if isinstance(result, dict) and result.get('err_code', 0) == 0:
+                self.cache.Insert(self.LIGHT_STATE, {target: {command: result}})
+            return
+        super(Bulb, self).HandleResult(target, command, argument, result)
 
     def HasEmeter(self):
         return True
@@ -92,11 +89,31 @@ class Bulb(Device):
     def IsOn(self):
         return bool(self.GetLightState('on_off'))
 
+    def MergeState(self, target, state, values):
+        if target != self.LIGHT_STATE:
+            return super(Bulb, self).MergeState(target, state, values)
+        # The light values are reported at the top level while the bulb is
+        # on and under dft_on_state while it is off.
+        values = dict(values)
+        on = values.pop('on_off', state.get('on_off'))
+        if on and not state.get('on_off'):
+            state.update(state.pop('dft_on_state', {}))
+        elif not on and state.get('on_off'):
+            state['dft_on_state'] = {key: value for key, value in state.items()
+                if key not in ('on_off', 'err_code', 'dft_on_state')}
+            for key in state['dft_on_state']:
+                del state[key]
+        state['on_off'] = on
+        if on:
+            state.update(values)
+        else:
+            state.setdefault('dft_on_state', {}).update(values)
+
     def On(self, transition=0):
-        return self.SetLightState({'on_off': 1})
+        return self.Set(*self.StateQuery(1), effects=[self.StateEffect(1)])
 
     def Off(self, transition=0):
-        return self.SetLightState({'on_off': 0})
+        return self.Set(*self.StateQuery(0), effects=[self.StateEffect(0)])
 
     def SetBrightness(self, value):
         if not self.IsColorSupported():
@@ -113,8 +130,8 @@ class Bulb(Device):
         return self.SetLightState({'color_temp': value})
 
     def SetLightState(self, state):
-        return self.Send(
-            self.QueryHelper(self.LIGHT_STATE, 'transition_light_state', state))
+        return self.Set(self.LIGHT_STATE, 'transition_light_state', state,
+            effects=[(self.LIGHT_STATE, 'get_light_state', state)])
 
     def SetValues(self, hue, saturation, value):
         if not self.IsColorSupported():
@@ -128,6 +145,18 @@ class Bulb(Device):
             'hue': hue, 'saturation': saturation, 'brightness': value,
             'color_temp': 0})
 
+    def StateEffect(self, state):
+        return (self.LIGHT_STATE, 'get_light_state', {'on_off': state})
+
+    def StateQuery(self, state):
+        return (self.LIGHT_STATE, 'transition_light_state', {'on_off': state})
+
+    def __GetLightValue(self, key):
+        info = self.GetLightState()
+        if not info.get('on_off') and 'dft_on_state' in info:
+            return info['dft_on_state'].get(key, 0)
+        return info.get(key, 0)
+
     @staticmethod
     def __ValidateBrightness(value):
         if not isinstance(value, int) or not (0 <= value <= 100):
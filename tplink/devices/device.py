@@ -12,14 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import json
 import os
 import socket
 import struct
 import sys
+import threading
+import time
 from monitor.lib.utils import GetErrorMessage
 from .emeter import EmeterHandler
+from .. import cipher
 from ..exceptions import ConnectionError, DeviceError, InputError
+from ..framing import FrameReader
 from ..utils import Cache, IsValidMacAddress
 
 
@@ -34,39 +39,84 @@ class Device(object):
 
     DEFAULT_PORT = 9999
     ENCRYPTION_KEY = 0xAB
+    RECONCILE_DELAY = 2.0
+    TIMEOUT = 3
+    DEADLINE = 10
 
     def __init__(self, address=None, type=DeviceType.NONE, info=None, key=None,
-            port=DEFAULT_PORT, logger=None):
+            port=DEFAULT_PORT, logger=None, pool=None, cache=None, features=None,
+            timeout=None, connectTimeout=None, latency=None):
         self.address = address
         self.port = int(port)
         self.key = key or self.ENCRYPTION_KEY
         self.type = type or DeviceType.NONE
         self.emeter = None
-        self.cache = Cache()
+        self.features = list(features) if features is not None else None
+        self.cache = (cache if cache is not None else Cache()).View((self.address, self.port))
         self.logger = logger
+        self.pool = pool
+        self.timeout = timeout or self.TIMEOUT
+        self.connectTimeout = connectTimeout or self.timeout
+        self.latency = latency
+        self.reconcileDelay = self.RECONCILE_DELAY
+        self.reconcileLock = threading.Lock()
+        self.reconcileQueries = set()
+        self.reconcileTimer = None
+        self.writes = 0
+        if info is not None:
+            self.HandleInfo(info)
 
     @staticmethod
     def Decrypt(message, key):
-        buffer = []
-        for cipherbyte in message:
-            plainbyte = key ^ cipherbyte
-            key = cipherbyte
-            buffer.append(plainbyte)
-
-        plaintext = bytes(buffer)
-        return plaintext.decode()
+        return cipher.Decrypt(message, key).decode()
 
     @staticmethod
     def Encrypt(message, key):
         plainbytes = message.encode()
-        buffer = bytearray(struct.pack(">I", len(plainbytes)))
-
-        for plainbyte in plainbytes:
-            cipherbyte = key ^ plainbyte
-            key = cipherbyte
-            buffer.append(cipherbyte)
-
-        return bytes(buffer)
+        return struct.pack(">I", len(plainbytes)) + cipher.Encrypt(plainbytes, key)
+
+    def ApplyState(self, target, command, values, reconcile=True):
+        """
+        Apply the known effect of a successful write to the cached response
+        of a read query, so the next read does not need a round trip. The
+        query is refreshed in the background shortly after to correct the
+        cache should the device not have applied the write as expected.
+
+        :param target: Module of the read query.
+        :param command: Read command whose cached response is updated.
+        :param values: Dictionary of the values written.
+        :param reconcile: Schedule the background refresh. Callers which
+            schedule their own, such as AsyncDevice, pass False.
+        :return: True if a cached response was updated.
+        """
+        self.writes += 1
+        cached = self.cache.Get(target)
+        updated = False
+        if cached is not None and isinstance(cached.get(target, {}).get(command), dict):
+            state = copy.deepcopy(cached[target][command])
+            self.MergeState(target, state, values)
+            self.cache.Insert(target, {target: {command: state}})
+            updated = True
+        if reconcile:
+            self.ScheduleReconcile(target, command)
+        return updated
+
+    def Batch(self, queries):
+        """
+        Send several module queries to the device in a single request. Each
+        (target, command) pair may only appear once per batch.
+
+        :param queries: List of (target, command, argument) tuples.
+        :return: Dictionary of (target, command) to the module response.
+        """
+        queries = [tuple(query) + (None,) * (3 - len(query)) for query in queries]
+        return self.HandleBatch(queries, self.Send(self.BatchQueryHelper(queries)))
+
+    def ConnectionFailure(self, err):
+        return ConnectionError(err,
+            "Error connecting to '{}' ({}): [{}] {}".format(
+                self.GetType(), self.address, err,
+                GetErrorMessage(err) if err else 'None'))
 
     def GetAlias(self):
         return self.GetSysInfo('alias')
@@ -91,6 +141,10 @@ class Device(object):
         raise NotImplementedError
 
     def GetFeatures(self):
+        # Features are fixed for a model, so a known feature list avoids a
+        # sysinfo request for capability checks.
+        if self.features is not None:
+            return self.features
         value = self.GetSysInfo('feature')
         return value.split(':') if value is not None else []
 
@@ -102,11 +156,7 @@ class Device(object):
         if info is None:
             info = self.Send(
                 self.QueryHelper('system', 'get_sysinfo'))
-        if info is not None:
-            self.cache.Insert('system', info)
-        if key is not None:
-            return info[key]
-        return info
+        return self.HandleInfo(info, key)
 
     def GetHardwareVersion(self):
         return self.GetSysInfo('hw_ver')
@@ -166,6 +216,54 @@ class Device(object):
             return int(value)
         return int(-1)
 
+    def HandleBatch(self, queries, response):
+        """
+        Process the response of a batched request.
+
+        :param queries: List of (target, command, argument) tuples.
+        :param response: Decoded device response.
+        :return: Dictionary of (target, command) to the module response.
+        """
+        # Process sysinfo first since the emeter handling depends on the
+        # feature flags it contains.
+        ordered = sorted(queries, key=lambda query: query[0] != 'system')
+        results = {}
+        for target, command, argument in ordered:
+            module = response.get(target) or {}
+            result = module.get(command, module)
+            results[(target, command)] = result
+            self.HandleResult(target, command, argument, result)
+        return results
+
+    def HandleInfo(self, info, key=None):
+        if info is not None:
+            self.cache.Insert('system', info)
+        if key is not None:
+            return info[key]
+        return info
+
+    def HandleResult(self, target, command, argument, result):
+        """
+        Store the response to a single module query in the device cache.
+
+        :param target: Query module.
+        :param command: Query command.
+        :param argument: Query argument.
+        :param result: Module response for the command.
+        :return: None
+        """
+        if not isinstance(result, dict) or result.get('err_code', 0) != 0:
+            return
+        if target == 'system' and command == 'get_sysinfo':
+            self.HandleInfo({target: {command: result}})
+            return
+        try:
+            emeterType = self.GetEmeterType()
+        except (DeviceError, NotImplementedError):
+            return
+        if target == emeterType:
+            self.GetEmeter().HandleResult(command, argument, result)
+
     def HasEmeter(self):
         raise NotImplementedError
 
@@ -187,6 +285,12 @@ class Device(object):
     def IsPlug(self):
         return self.type == DeviceType.PLUG
 
+    def MergeState(self, target, state, values):
+        """
+        Merge written values into a copy of a cached read response.
+        """
+        state.update(values)
+
     def Off(self):
         # Device Specific Implementation
         raise NotImplementedError
@@ -195,44 +299,112 @@ class Device(object):
         # Device Specific Implementation
         raise NotImplementedError
 
+    def ParseResponse(self, payload):
+        if self.latency is None:
+            return json.loads(self.Decrypt(payload, self.key))
+        with self.latency.Time('decrypt'):
+            message = self.Decrypt(payload, self.key)
+        with self.latency.Time('parse'):
+            return json.loads(message)
+
     def Reboot(self, delay=0):
         return self.Send(
             self.QueryHelper('system', 'reboot', {'delay': delay}))
 
+    def Reconcile(self):
+        """
+        Refresh the read queries touched by writes since the last reconcile
+        in a single request. Failed refreshes drop the cached responses so
+        the next read goes to the device.
+        """
+        with self.reconcileLock:
+            queries = sorted(self.reconcileQueries)
+            self.reconcileQueries = set()
+            self.reconcileTimer = None
+        if not queries:
+            return
+        writes = self.writes
+        try:
+            self.Batch([(target, command, None) for (target, command) in queries])
+        except DeviceError as e:
+            if self.logger:
+                self.logger.debug("Failed to reconcile '{}': {}".format(self.address, e.message))
+            for (target, _) in queries:
+                self.cache.Invalidate(target)
+            return
+        # A write which finished while the refresh was in flight may have
+        # been overwritten by the older response.
+        if self.writes != writes:
+            for (target, command) in queries:
+                self.ScheduleReconcile(target, command)
+
     def Send(self, message):
         encrypted = self.Encrypt(message, self.key)
+        deadline = time.monotonic() + self.DEADLINE
+
+        def Read(sock):
+            return FrameReader(sock, key=self.key, readTimeout=self.timeout,
+                deadline=deadline, latency=self.latency).Read()
 
         sock = None
         try:
-            sock = socket.create_connection((self.address, self.port), 3)
-            sock.send(encrypted)
-
-            buffer = bytes()
-            length = -1
-            while True:
-                chunk = sock.recv(4096)
-                if length == -1:
-                    length = struct.unpack(">I", chunk[0:4])[0]
-                buffer += chunk
-                if (length > 0 and len(buffer) >= length + 4) or not chunk:
-                    break
+            if self.pool is not None:
+                response = self.pool.Request(self.address, self.port, encrypted,
+                    self.timeout, read=Read, connectTimeout=self.connectTimeout,
+                    latency=self.latency)
+            else:
+                start = time.perf_counter()
+                sock = socket.create_connection((self.address, self.port),
+                    self.connectTimeout)
+                if self.latency is not None:
+                    self.latency.Record('connect', time.perf_counter() - start)
+                sock.settimeout(self.timeout)
+                sock.sendall(encrypted)
+                response = Read(sock)
         except OSError as e:
             if self.logger:
-                self.logger.exception('Error connecting to: {} ({})'.format(self.address, e))
-            raise ConnectionError(e.errno,
-                "Error connecting to '{}' ({}): [{}] {}".format(
-                    self.GetType(), self.address, e.errno,
-                    GetErrorMessage(e.errno) if e.errno else 'None'))
+                self.logger.warning('Error connecting to: {} ({})'.format(self.address, e))
+            raise self.ConnectionFailure(e.errno)
         finally:
-            try:
-                sock.close()
-            except:
-                pass
-
-        response = self.Decrypt(buffer[4:], self.key)
-        return json.loads(response)
-
-    def Set(self, category, option, value):
+            if sock is not None:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+        if self.latency is None:
+            return json.loads(response)
+        with self.latency.Time('parse'):
+            return json.loads(response)
+
+    def ScheduleReconcile(self, target, command):
+        """
+        Queue a read query for the next background reconcile. Queries of
+        writes in quick succession are coalesced into a single refresh.
+        """
+        if not self.reconcileDelay or self.reconcileDelay <= 0:
+            self.cache.Invalidate(target)
+            return
+        with self.reconcileLock:
+            self.reconcileQueries.add((target, command))
+            if self.reconcileTimer is None:
+                self.reconcileTimer = threading.Timer(self.reconcileDelay, self.Reconcile)
+                self.reconcileTimer.daemon = True
+                self.reconcileTimer.start()
+
+    def Set(self, category, option, value, effects=None):
+        """
+        Send a write command to the device.
+
+        :param category: Module of the command.
+        :param option: Write command.
+        :param value: Command argument.
+        :param effects: Optional list of (target, command, values) tuples
+            describing how the write changes the responses of read queries.
+            These are applied to the cache, otherwise the whole device cache
+            is cleared.
+        :return: True if the device accepted the command.
+        """
         result = self.Send(self.QueryHelper(category, option, value))
         if result is None or len(result) == 0:
             if self.logger:
@@ -250,11 +422,15 @@ class Device(object):
         response = result[category][option]
         if 'err_code' not in response or response['err_code'] != 0:
             return False
-        self.cache.Clear()
+        if effects is None:
+            self.cache.Clear()
+        for (target, command, values) in effects or []:
+            self.ApplyState(target, command, values)
         return True
 
     def SetAlias(self, alias):
-        return self.Set('system', 'set_dev_alias', {'alias': alias})
+        return self.Set('system', 'set_dev_alias', {'alias': alias},
+            effects=[('system', 'get_sysinfo', {'alias': alias})])
 
     def SetMacAddress(self, address):
         if not IsValidMacAddress(address):
@@ -262,7 +438,22 @@ class Device(object):
         return self.Send(
             self.QueryHelper('system', 'set_mac_addr', {'mac': address}))
 
+    def StateEffect(self, state):
+        # Device Specific Implementation
+        raise NotImplementedError
+
+    def StateQuery(self, state):
+        # Device Specific Implementation
+        raise NotImplementedError
+
     @staticmethod
     def QueryHelper(target, command, argument=None):
         message = {target: {command: argument or {}}}
         return json.dumps(message)
+
+    @staticmethod
+    def BatchQueryHelper(queries):
+        message = {}
+        for target, command, argument in queries:
+            message.setdefault(target, {})[command] = argument or {}
+        return json.dumps(message)
@@ -13,152 +13,235 @@
 # limitations under the License.
 
 from datetime import datetime
+from .sample import RealtimeSample
 from ..exceptions import DeviceError
 from ..utils import Cache
 
 
 class EmeterHandler(object):
+    """
+    Electricity meter module of a device. The daily and monthly statistics
+    are fetched once per (year, month) and (year) and every aggregate is
+    derived from the cached lists. Statistics of past periods never change
+    so they are cached forever, the current period for STATS_TTL seconds.
+    """
+
+    STATS_TTL = 60.0
+    TYPES = ('emeter', 'smartlife.iot.common.emeter')
 
     def __init__(self, device):
         if not device.HasEmeter():
             raise DeviceError('Device does not support the emeter')
         self.device = device
         self.emeterType = device.GetEmeterType()
-        self.__cache = Cache()
+        self.deviceId = None
+        self.__cache = device.cache.View((device.address, device.port, 'emeter'))
 
     def ClearDeviceStats(self):
-        return self.Send(
+        result = self.Send(
             self.QueryHelper(self.emeterType, 'erase_emeter_stat', None))
+        self.__cache.Clear()
+        return result
 
     def GetAmps(self):
-        value = self.GetRealtime()
-        if value is None:
-            raise DeviceError('Failed to get realtime emeter stats')
-        if 'current' in value:
-            return float(value['current'])
-        return 0
+        return self.GetSample().current or 0
+
+    def GetCachedRealtime(self):
+        return self.__cache.Get(self.emeterType)
 
     def GetConsumption(self):
         """
         Retrieve realtime energy concumption in watts
         """
-        value = self.GetRealtime()
-        if value is None:
-            raise DeviceError('Failed to get realtime emeter stats')
-        if 'power' in value:
-            return float(value['power'])
-        raise DeviceError('Unknown output from emeter realtime')
+        power = self.GetSample().power
+        if power is None:
+            raise DeviceError('Unknown output from emeter realtime')
+        return power
 
     def GetDailyAverage(self):
-        total = 0.0
-        data = self.GetDailyUsage()
-        for day in data:
-            if 'energy' in day:
-                total += float(day['energy'])
-            elif 'energy_wh' in day:
-                total += float(day['energy_wh'])
-            else:
-                return float(-1)
-        if total <= 0:
-            return 0.0
-        return float(total / len(data))
-
-    def GetDailyUsage(self, month=None, year=None):
-        response = self.Send(
-            self.QueryHelper(self.emeterType,
-                'get_daystat', {
-                    'month': int(month or datetime.now().month),
-                    'year': int(year or datetime.now().year)
-                }))
+        """
+        Average energy per day of the current month in Wh.
+        """
+        return self.__Average(self.GetDailyUsage())
 
-        data = response[self.emeterType]['get_daystat']['day_list']
+    def GetDailyUsage(self, month=None, year=None, cache=True):
+        argument = {
+            'month': int(month or datetime.now().month),
+            'year': int(year or datetime.now().year)
+        }
+        data = None
+        if cache:
+            data = self.__cache.Get(('get_daystat', argument['year'], argument['month']))
+        if data is None:
+            response = self.Send(
+                self.QueryHelper(self.emeterType, 'get_daystat', argument))
+            data = self.HandleResult('get_daystat', argument,
+                response[self.emeterType]['get_daystat'])
         return data
 
-    def GetMonthlyAverage(self):
-        total = 0.0
-        data = self.GetDailyUsage()
-        for month in data:
-            if 'energy' in month:
-                total += float(month['energy'])
-            elif 'energy_wh' in month:
-                total += float(month['energy_wh'])
-            else:
-                return float(-1)
-        if total <= 0:
-            return 0.0
-        return float(total / len(data))
+    @staticmethod
+    def GetEnergy(entry):
+        """
+        Energy of a daily or monthly statistics entry in Wh. Older firmware
+        reports 'energy' in kWh while newer firmware reports 'energy_wh'.
 
-    def GetMonthlyUsage(self, year=None):
-        response = self.Send(
-            self.QueryHelper(self.emeterType,
-                'get_monthstat', {
-                    'year': int(year or datetime.now().year)
-                }))
+        :param entry: Entry of a day_list or month_list.
+        :return: Energy in Wh or None if the entry has no energy value.
+        """
+        if 'energy_wh' in entry:
+            return float(entry['energy_wh'])
+        if 'energy' in entry:
+            return float(entry['energy']) * 1000.0
+        return None
 
-        data = response[self.emeterType]['get_monthstat']['month_list']
-        return data
+    def GetMonthlyAverage(self):
+        """
+        Average energy per month of the current year in Wh.
+        """
+        return self.__Average(self.GetMonthlyUsage())
 
-    def GetRealtime(self, key=None, cache=True):
+    def GetMonthlyUsage(self, year=None, cache=True):
+        argument = {
+            'year': int(year or datetime.now().year)
+        }
         data = None
         if cache:
-            data = self.__cache.Get(self.emeterType)
+            data = self.__cache.Get(('get_monthstat', argument['year']))
         if data is None:
-            data = self.Send(self.QueryHelper(self.emeterType, 'get_realtime'))
-        data = self.ProcessRealtimeData(data)
-        if data is not None:
-            self.__cache.Insert(self.emeterType, data)
+            response = self.Send(
+                self.QueryHelper(self.emeterType, 'get_monthstat', argument))
+            data = self.HandleResult('get_monthstat', argument,
+                response[self.emeterType]['get_monthstat'])
+        return data
+
+    def GetRealtime(self, key=None, cache=True):
+        sample = self.GetSample(cache)
         if key is not None:
-            return data[self.emeterType]['get_realtime'].get(key)
-        return data[self.emeterType]['get_realtime']
+            return sample.Get(key)
+        return sample.AsDict()
+
+    def GetSample(self, cache=True):
+        """
+        Return the realtime reading as a RealtimeSample.
+
+        :param cache: Use a cached reading if one is available.
+        :return: RealtimeSample instance.
+        """
+        sample = None
+        if cache:
+            sample = self.GetCachedRealtime()
+        if sample is None:
+            response = self.Send(self.QueryHelper(self.emeterType, 'get_realtime'))
+            sample = self.HandleRealtime(response[self.emeterType]['get_realtime'])
+        return sample
+
+    @classmethod
+    def GetStatsTTL(cls, period):
+        """
+        :param period: Tuple of (year,) or (year, month).
+        :return: Cache TTL of the statistics of the period.
+        """
+        now = datetime.now()
+        if period < (now.year, now.month)[:len(period)]:
+            return Cache.FOREVER
+        return cls.STATS_TTL
 
     def GetUsageMonth(self):
-        data = self.GetDailyUsage()
-        month = datetime.now().month
-        year = datetime.now().year
-        for entry in data:
-            if entry['month'] == month and entry['year'] == year:
-                if 'energy' in entry:
-                    return float(entry['energy'])
-                elif 'energy_wh' in entry:
-                    return float(entry['energy_wh'])
-                else:
-                    return float(-1)
-        return float(-1)
+        """
+        Energy used in the current month in Wh.
+        """
+        now = datetime.now()
+        return self.__Find(self.GetMonthlyUsage(), year=now.year, month=now.month)
 
     def GetUsageToday(self):
-        data = self.GetDailyUsage()
-        today = datetime.now().day
-        for entry in data:
-            if entry['day'] == today:
-                if 'energy' in entry:
-                    return float(entry['energy'])
-                elif 'energy_wh' in entry:
-                    return float(entry['energy_wh'])
-                else:
-                    return float(-1)
-        return float(-1)
+        """
+        Energy used today in Wh.
+        """
+        now = datetime.now()
+        return self.__Find(self.GetDailyUsage(), year=now.year, month=now.month, day=now.day)
 
     def GetVoltage(self):
-        value = self.GetRealtime()
-        if value is None:
-            raise DeviceError('Failed to get realtime emeter stats')
-        if 'voltage' in value:
-            return float(value['voltage'])
-        return 0
+        return self.GetSample().voltage or 0
 
-    @staticmethod
-    def ProcessRealtimeData(data):
-        if 'emeter' not in data:
-            return data
-        d = dict()
-        emeter = data['emeter']['get_realtime']
-        for key, value in emeter.items():
-            suffix = key[-3:]
-            if suffix in ['_ma', '_mv', '_mw']:
-                d[key[:-3]] = float(value) / 1000.0
-            else:
-                d[key] = value
-        return {'emeter': {'get_realtime': d}}
+    def HandleRealtime(self, result):
+        """
+        Convert a get_realtime response into a sample and cache it.
+
+        :param result: Module response for get_realtime.
+        :return: RealtimeSample instance.
+        """
+        if self.deviceId is None:
+            # Only use sysinfo which is already cached, this must never cost
+            # an extra request on the poll path.
+            info = self.device.cache.Get('system')
+            if info is not None:
+                self.deviceId = info['system']['get_sysinfo'].get('deviceId')
+        sample = RealtimeSample.FromResponse(result, deviceId=self.deviceId)
+        self.__cache.Insert(self.emeterType, sample)
+        return sample
+
+    def HandleResult(self, command, argument, result):
+        """
+        Store the response to an emeter query in the cache.
+
+        :param command: Emeter command.
+        :param argument: Query argument.
+        :param result: Module response for the command.
+        :return: Processed result.
+        """
+        match command:
+            case 'get_realtime':
+                return self.HandleRealtime(result)
+            case 'get_daystat':
+                data = result['day_list']
+                period = (int(argument['year']), int(argument['month']))
+                self.__cache.Insert((command,) + period, data, ttl=self.GetStatsTTL(period))
+                return data
+            case 'get_monthstat':
+                data = result['month_list']
+                period = (int(argument['year']),)
+                self.__cache.Insert((command,) + period, data, ttl=self.GetStatsTTL(period))
+                return data
+        return result
+
+    @classmethod
+    def RealtimeQueries(cls):
+        """
+        Realtime queries for every emeter module, for batching with the
+        sysinfo query before the device type is known.
+        """
+        return [(target, 'get_realtime', None) for target in cls.TYPES]
+
+    @classmethod
+    def StatisticsQueries(cls, month=None, year=None):
+        """
+        Realtime, daily and monthly statistics queries for every emeter
+        module for the given month.
+        """
+        month = int(month or datetime.now().month)
+        year = int(year or datetime.now().year)
+        queries = cls.RealtimeQueries()
+        for target in cls.TYPES:
+            queries.append((target, 'get_daystat', {'month': month, 'year': year}))
+            queries.append((target, 'get_monthstat', {'year': year}))
+        return queries
+
+    @classmethod
+    def __Average(cls, entries):
+        values = [cls.GetEnergy(entry) for entry in entries]
+        if not values:
+            return 0.0
+        if None in values:
+            return float(-1)
+        return sum(values) / len(values)
+
+    @classmethod
+    def __Find(cls, entries, **period):
+        for entry in entries:
+            if all(entry.get(key) == value for key, value in period.items()):
+                energy = cls.GetEnergy(entry)
+                return float(-1) if energy is None else energy
+        return float(-1)
 
     def QueryHelper(self, *args):
         return self.device.QueryHelper(*args)
@@ -48,9 +48,13 @@ class Plug(Device):
         return bool(self.GetSysInfo('led_off') == 0)
 
     def Off(self):
-        return self.Send(
-            self.QueryHelper('system', 'set_relay_state', {'state': 0}))
+        return self.Set(*self.StateQuery(0), effects=[self.StateEffect(0)])
 
     def On(self):
-        return self.Send(
-            self.QueryHelper('system', 'set_relay_state', {'state': 1}))
+        return self.Set(*self.StateQuery(1), effects=[self.StateEffect(1)])
+
+    def StateEffect(self, state):
+        return ('system', 'get_sysinfo', {'relay_state': state})
+
+    def StateQuery(self, state):
+        return ('system', 'set_relay_state', {'state': state})
@@ -0,0 +1,91 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+
+
+class RealtimeSample(object):
+    """
+    Single realtime emeter reading in base units: amps, volts, watts and
+    kWh. Firmware reports either base units or milli units (current_ma,
+    voltage_mv, power_mw, total_wh) which are converted once on creation.
+    """
+
+    __slots__ = ('timestamp', 'deviceId', 'current', 'voltage', 'power', 'total', 'errorCode')
+
+    FIELDS = ('current', 'voltage', 'power', 'total')
+
+    # Firmware key to (field, scale).
+    KEYS = {
+        'current': ('current', 1.0),
+        'current_ma': ('current', 0.001),
+        'voltage': ('voltage', 1.0),
+        'voltage_mv': ('voltage', 0.001),
+        'power': ('power', 1.0),
+        'power_mw': ('power', 0.001),
+        'total': ('total', 1.0),
+        'total_wh': ('total', 0.001),
+    }
+
+    def __init__(self, timestamp=None, deviceId=None, current=None, voltage=None,
+            power=None, total=None, errorCode=0):
+        self.timestamp = timestamp
+        self.deviceId = deviceId
+        self.current = current
+        self.voltage = voltage
+        self.power = power
+        self.total = total
+        self.errorCode = errorCode
+
+    def __repr__(self):
+        return '<RealtimeSample: {} {}>'.format(self.deviceId, ' '.join(
+            '{}={}'.format(key, value) for key, value in self.Items()))
+
+    def AsDict(self):
+        data = dict(self.Items())
+        data['err_code'] = self.errorCode
+        return data
+
+    @classmethod
+    def FromResponse(cls, data, deviceId=None, timestamp=None):
+        """
+        Create a sample from the get_realtime response of the emeter module.
+
+        :param data: Decoded get_realtime response.
+        :param deviceId: Optional device identifier.
+        :param timestamp: Time of the reading, defaults to now.
+        :return: RealtimeSample instance.
+        """
+        sample = cls(time.time() if timestamp is None else timestamp, deviceId,
+            errorCode=data.get('err_code', 0))
+        for key, value in data.items():
+            conversion = cls.KEYS.get(key)
+            if conversion is not None:
+                setattr(sample, conversion[0], float(value) * conversion[1])
+        return sample
+
+    def Get(self, key, default=None):
+        if key == 'err_code':
+            return self.errorCode
+        if key not in self.__slots__:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def Items(self):
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                yield key, value
@@ -1 +1,3 @@
-from .utils import GetDeviceType, LoadDevice, LoadDevices
+from .broadcast import DiscoverDevices
+from .registry import Registry
+from .utils import BuildDevice, GetDeviceType, LoadDevice, LoadDeviceAsync, LoadDevices
@@ -0,0 +1,96 @@
+import json
+import socket
+import time
+from .utils import GetDeviceType
+from ..devices import Device
+from ..exceptions import DeviceError
+
+BROADCAST_ADDRESS = '255.255.255.255'
+DISCOVERY_QUERY = Device.QueryHelper('system', 'get_sysinfo')
+
+
+def DecodeReply(data, key=Device.ENCRYPTION_KEY):
+    """
+    Decode a UDP discovery reply. Datagrams carry the encrypted payload
+    without the 4-byte length header used on TCP.
+
+    :param data: Raw datagram.
+    :param key: Encryption key.
+    :return: Decoded response or None if it is not a valid reply.
+    """
+    try:
+        info = json.loads(Device.Decrypt(data, key))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(info, dict) or 'system' not in info:
+        return None
+    return info
+
+
+def DiscoverDevices(address=BROADCAST_ADDRESS, port=Device.DEFAULT_PORT, timeout=3.0,
+        attempts=2, key=Device.ENCRYPTION_KEY, logger=None, pool=None, cache=None):
+    """
+    Discover devices by broadcasting a sysinfo query over UDP and collecting
+    the replies until the timeout expires. Every reply already contains the
+    sysinfo, so the devices are built without any further requests.
+
+    :param address: Broadcast or unicast address to probe.
+    :param port: Device port.
+    :param timeout: Seconds to wait for replies.
+    :param attempts: Number of probes sent, since datagrams may be lost.
+    :param key: Encryption key.
+    :param logger: Logger instance passed to the devices.
+    :param pool: Optional connection pool passed to the devices.
+    :param cache: Optional cache shared by the devices.
+    :return: List of devices ordered by address.
+    """
+    payload = Device.Encrypt(DISCOVERY_QUERY, key)[4:]
+    devices = {}
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        interval = timeout / (attempts + 1)
+        deadline = time.monotonic() + timeout
+        nextProbe = time.monotonic()
+        sent = 0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if sent < attempts and now >= nextProbe:
+                sock.sendto(payload, (address, port))
+                sent += 1
+                nextProbe = now + interval
+            wait = deadline - now
+            if sent < attempts:
+                wait = min(wait, max(0.0, nextProbe - now))
+            sock.settimeout(max(wait, 0.001))
+            try:
+                data, source = sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+
+            info = DecodeReply(data, key)
+            if info is None:
+                continue
+            sysinfo = info['system'].get('get_sysinfo') or {}
+            identifier = (sysinfo.get('deviceId') or sysinfo.get('mac')
+                or sysinfo.get('mic_mac') or source)
+            if identifier in devices:
+                continue
+            try:
+                DeviceType = GetDeviceType(info)
+            except DeviceError:
+                DeviceType = None
+            if DeviceType is None:
+                if logger:
+                    logger.warning('Unsupported device type at: {}'.format(source[0]))
+                continue
+            devices[identifier] = DeviceType(address=source[0], port=source[1], key=key,
+                info=info, logger=logger, pool=pool, cache=cache)
+    finally:
+        sock.close()
+
+    return sorted(devices.values(), key=lambda device: (
+        socket.inet_aton(device.address), device.port))
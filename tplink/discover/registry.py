@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from .utils import GetDeviceType
+from ..devices import Bulb, Device, LightStrip, Plug
+from ..exceptions import DeviceError
+
+FLAGS = ('is_dimmable', 'is_color', 'is_variable_color_temp')
+
+
+class Registry(object):
+    """
+    Device registry persisted as a JSON file. It records the type, model
+    and feature flags of every device seen so later runs can build device
+    objects without a sysinfo request for type detection. Devices built
+    from the registry are revalidated in the background.
+
+    A read-only registry never writes the file. Processes sharing a file
+    hand the entries they recorded, returned by Changes, to the one process
+    which merges and saves them.
+    """
+
+    VERSION = 1
+    TYPES = {cls.__name__: cls for cls in (Bulb, LightStrip, Plug)}
+
+    def __init__(self, path, logger=None, readOnly=False):
+        self.path = path
+        self.logger = logger
+        self.readOnly = readOnly
+        self.entries = {}
+        self.changed = set()
+        self.pending = []
+        self.dirty = False
+        self.lock = threading.RLock()
+        self.thread = None
+
+    @staticmethod
+    def Key(address, port):
+        return '{}:{}'.format(address, int(port))
+
+    def Build(self, address, port=Device.DEFAULT_PORT, **kwargs):
+        """
+        Create the device object for a registered address without
+        contacting the device. Keyword arguments are passed to the device.
+
+        :return: Device instance or None if the address is not registered.
+        """
+        with self.lock:
+            entry = self.entries.get(self.Key(address, port))
+        if entry is None or entry.get('type') not in self.TYPES:
+            return None
+        DeviceType = self.TYPES[entry['type']]
+        return DeviceType(address=address, port=port, features=entry.get('features'),
+            **kwargs)
+
+    def Changes(self):
+        """
+        :return: Dictionary of the entries recorded since the last call.
+        """
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            return {key: self.entries[key] for key in changed if key in self.entries}
+
+    def Get(self, address, port=Device.DEFAULT_PORT):
+        with self.lock:
+            return self.entries.get(self.Key(address, port))
+
+    def Load(self):
+        """
+        Read the registry file. A missing or unreadable file leaves the
+        registry empty so devices are detected normally.
+
+        :return: True if the file was loaded.
+        """
+        try:
+            with open(self.path, 'r') as handle:
+                data = json.load(handle)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            if self.logger:
+                self.logger.warning("Ignoring unreadable device registry '{}': {}".format(
+                    self.path, e))
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return False
+        with self.lock:
+            self.entries = dict(data.get('devices') or {})
+        return True
+
+    def Merge(self, entries):
+        """
+        Add entries recorded by another registry instance.
+
+        :param entries: Dictionary returned by Changes.
+        """
+        if not entries:
+            return
+        with self.lock:
+            self.entries.update(entries)
+            self.dirty = True
+
+    def Queue(self, device):
+        """
+        Queue a device built from the registry for background revalidation.
+        """
+        with self.lock:
+            self.pending.append(device)
+
+    def Record(self, device):
+        """
+        Update the entry of a device from its cached sysinfo.
+
+        :param device: Device with sysinfo available.
+        :return: None
+        """
+        sysinfo = device.GetSysInfo()
+        entry = {
+            'address': device.address,
+            'port': device.port,
+            'deviceId': sysinfo.get('deviceId'),
+            'type': type(device).__name__,
+            'model': sysinfo.get('model'),
+            'features': [feature for feature in (sysinfo.get('feature') or '').split(':')
+                if feature],
+            'flags': {flag: sysinfo[flag] for flag in FLAGS if flag in sysinfo},
+            'lastSeen': int(time.time()),
+        }
+        with self.lock:
+            key = self.Key(device.address, device.port)
+            self.entries[key] = entry
+            self.changed.add(key)
+            self.dirty = True
+
+    def Revalidate(self, devices):
+        """
+        Refresh the sysinfo of each device and update its entry. Devices
+        whose type changed are reported and re-registered under the new type
+        which takes effect the next time they are built.
+
+        :param devices: Devices to revalidate.
+        :return: None
+        """
+        for device in devices:
+            device.cache.Invalidate('system')
+            try:
+                info = device.GetInfo()
+                DeviceType = GetDeviceType(info)
+            except DeviceError as e:
+                if self.logger:
+                    self.logger.warning('Unable to revalidate {}: {}'.format(
+                        device.address, e.message))
+                continue
+            if DeviceType is not None and not isinstance(device, DeviceType):
+                if self.logger:
+                    self.logger.warning('Device {} changed type from {} to {}'.format(
+                        device.address, type(device).__name__, DeviceType.__name__))
+                device = DeviceType(address=device.address, port=device.port, info=info)
+            self.Record(device)
+        self.Save()
+
+    def RevalidatePending(self, wait=False):
+        """
+        Revalidate the devices built from the registry on a background thread.
+
+        :param wait: Block until the revalidation finished.
+        :return: None
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                thread = self.thread
+            elif self.pending:
+                devices, self.pending = self.pending, []
+                thread = self.thread = threading.Thread(target=self.Revalidate,
+                    args=(devices,), name='registry', daemon=True)
+                thread.start()
+            else:
+                thread = None
+        if wait and thread is not None:
+            thread.join()
+
+    def Save(self):
+        """
+        Write the registry atomically if it changed since the last save.
+
+        :return: None
+        """
+        with self.lock:
+            if not self.dirty or self.readOnly:
+                return
+            data = {'version': self.VERSION, 'devices': self.entries}
+            temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+            try:
+                with open(temporary, 'w') as handle:
+                    json.dump(data, handle, indent=2, sort_keys=True)
+                os.replace(temporary, self.path)
+            except OSError as e:
+                if self.logger:
+                    self.logger.warning("Failed to save device registry '{}': {}".format(
+                        self.path, e))
+                return
+            self.dirty = False
@@ -1,7 +1,27 @@
-from ..devices import Bulb, Device, LightStrip, Plug
+from ..devices import AsyncDevice, Bulb, Device, LightStrip, Plug
 from ..exceptions import DeviceError
 
 
+DEVICE_TYPES = {'bulb': Bulb, 'lightstrip': LightStrip, 'plug': Plug}
+
+
+def BuildDevice(type, address, port=Device.DEFAULT_PORT, emeter=True, **kwargs):
+    """
+    Create a device object of a declared type without contacting the
+    device. Keyword arguments are passed to the device.
+
+    :param type: Device type name: plug, bulb or lightstrip.
+    :param emeter: Whether the device has an emeter.
+    :return: Device instance or None if the type is unknown.
+    """
+    DeviceType = DEVICE_TYPES.get(str(type).replace(' ', '').replace('_', '').lower())
+    if DeviceType is None:
+        return None
+    if DeviceType is Plug:
+        kwargs['features'] = ['TIM', 'ENE'] if emeter else ['TIM']
+    return DeviceType(address=address, port=port, **kwargs)
+
+
 def GetDeviceType(info):
     deviceType = None
     sysinfo = None
@@ -24,22 +44,87 @@ def GetDeviceType(info):
     return None
 
 
-def LoadDevice(address, logger=None):
-    device = Device(address, logger=logger)
-    info = device.GetInfo()
+def LoadDevice(address, port=Device.DEFAULT_PORT, logger=None, pool=None, queries=None,
+        cache=None, registry=None, timeout=None, connectTimeout=None, latency=None):
+    """
+    Detect the device type and create the matching device object. Extra
+    queries are sent in the same request as the sysinfo query and their
+    results are cached on the returned device.
+
+    :param address: Device IPv4 address.
+    :param port: Device port.
+    :param logger: Logger instance.
+    :param pool: Optional connection pool.
+    :param queries: Optional list of (target, command, argument) tuples.
+    :param cache: Optional cache shared with other devices.
+    :param registry: Optional Registry. Registered devices are built without
+        type detection and only the extra queries are sent.
+    :param timeout: Optional socket read timeout in seconds.
+    :param connectTimeout: Optional connect timeout in seconds.
+    :param latency: Optional LatencyStats shared with the returned device.
+    :return: Device instance or None.
+    """
+    options = dict(logger=logger, pool=pool, cache=cache, timeout=timeout,
+        connectTimeout=connectTimeout, latency=latency)
+    if registry is not None:
+        device = registry.Build(address, port, **options)
+        if device is not None:
+            results = device.Batch(queries) if queries else {}
+            sysinfo = results.get(('system', 'get_sysinfo'))
+            if sysinfo is None or sysinfo.get('err_code', 0) != 0:
+                registry.Queue(device)
+                return device
+            # The sysinfo came along with the queries, which validates the
+            # registered type without another request.
+            info = {'system': {'get_sysinfo': sysinfo}}
+            DeviceType = GetDeviceType(info)
+            if DeviceType is not None and not isinstance(device, DeviceType):
+                device = DeviceType(address=address, port=port, info=info, **options)
+                for (target, command, argument) in queries:
+                    device.HandleResult(target, command, argument, results[(target, command)])
+            registry.Record(device)
+            return device
+
+    device = Device(address, port=port, **options)
+    results = {}
+    if queries:
+        queries = list(queries)
+        if not any(query[:2] == ('system', 'get_sysinfo') for query in queries):
+            queries.insert(0, ('system', 'get_sysinfo', None))
+        results = device.Batch(queries)
+        info = {'system': {'get_sysinfo': results[('system', 'get_sysinfo')]}}
+    else:
+        info = device.GetInfo()
+    if info is not None:
+        DeviceType = GetDeviceType(info)
+        if DeviceType is not None:
+            device = DeviceType(address=address, port=port, info=info, **options)
+            for (target, command, argument) in queries or []:
+                device.HandleResult(target, command, argument, results[(target, command)])
+            if registry is not None:
+                registry.Record(device)
+            return device
+    return None
+
+
+async def LoadDeviceAsync(address, port=Device.DEFAULT_PORT, logger=None, cache=None):
+    device = AsyncDevice(Device(address, port=port, logger=logger, cache=cache))
+    info = await device.GetInfo()
     if info is not None:
         DeviceType = GetDeviceType(info)
         if DeviceType is not None:
-            return DeviceType(address=address, info=info)
+            return AsyncDevice(DeviceType(address=address, port=port, info=info,
+                logger=logger, cache=cache))
     return None
 
 
-def LoadDevices(addresses, logger=None):
+def LoadDevices(addresses, logger=None, pool=None, cache=None, registry=None):
     devices = []
     if not addresses or len(addresses) == 0:
         return []
     for address in addresses:
-        device = LoadDevice(address, logger=logger)
+        device = LoadDevice(address, logger=logger, pool=pool, cache=cache,
+            registry=registry)
         if not device:
             if logger:
                 logger.error('Error: Unable to determine device type for: {}'.format(address))
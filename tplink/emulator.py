@@ -0,0 +1,214 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import copy
+import json
+import socketserver
+import struct
+import threading
+import time
+from .devices import Device
+
+PLUG_SYSINFO = {
+    'alias': 'Emulated Plug',
+    'dev_name': 'Smart Wi-Fi Plug With Energy Monitoring',
+    'deviceId': '0' * 40,
+    'err_code': 0,
+    'feature': 'TIM:ENE',
+    'fwId': '0' * 32,
+    'hwId': '0' * 32,
+    'hw_ver': '2.0',
+    'led_off': 0,
+    'mac': '50:C7:BF:00:00:00',
+    'model': 'HS110(US)',
+    'oemId': '0' * 32,
+    'on_time': 3600,
+    'relay_state': 1,
+    'rssi': -55,
+    'sw_ver': '1.5.4 Build 180815 Rel.121440',
+    'type': 'IOT.SMARTPLUGSWITCH',
+}
+
+PLUG_REALTIME = {
+    'current_ma': 512,
+    'voltage_mv': 120500,
+    'power_mw': 61000,
+    'total_wh': 13270,
+    'err_code': 0,
+}
+
+
+class Emulator(object):
+    """
+    Minimal TP-Link device emulator which speaks the framed TCP protocol on
+    a local socket and answers UDP discovery probes on the same port. Used
+    by the benchmarks and for exercising the library without real hardware
+    on the network.
+    """
+
+    def __init__(self, address='127.0.0.1', port=0, sysinfo=None, realtime=None,
+            latency=0.0, key=Device.ENCRYPTION_KEY, history=None):
+        """
+        :param history: Optional dictionary of (year, month, day) to the
+            energy used that day in Wh, served by the stats commands.
+        """
+        self.sysinfo = copy.deepcopy(sysinfo or PLUG_SYSINFO)
+        self.realtime = copy.deepcopy(realtime or PLUG_REALTIME)
+        self.history = dict(history or {})
+        self.latency = float(latency)
+        self.key = key
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(
+            (address, port), self.__CreateHandler(), bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.udpServer = socketserver.ThreadingUDPServer(
+            (address, self.port), self.__CreateDatagramHandler())
+        self.udpServer.daemon_threads = True
+        self.threads = []
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, *args):
+        self.Stop()
+
+    @property
+    def address(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def Handle(self, request):
+        """
+        Build the response for a decoded request. Every module and command
+        in the request is answered so batched queries behave like firmware.
+
+        :param request: Decoded JSON request.
+        :return: Response dictionary.
+        """
+        with self.lock:
+            self.requests += 1
+        response = {}
+        for target, commands in request.items():
+            if not self.Supports(target):
+                response[target] = {'err_code': -1, 'err_msg': 'module not support'}
+                continue
+            response[target] = {}
+            for command, argument in commands.items():
+                response[target][command] = self.HandleCommand(target, command, argument)
+        return response
+
+    def HandleCommand(self, target, command, argument):
+        if target == 'system' and command == 'get_sysinfo':
+            return copy.deepcopy(self.sysinfo)
+        if target == 'system' and command == 'set_relay_state':
+            self.sysinfo['relay_state'] = int(argument.get('state', 0))
+            return {'err_code': 0}
+        if target == 'system' and command == 'set_dev_alias':
+            self.sysinfo['alias'] = argument.get('alias', '')
+            return {'err_code': 0}
+        if target == 'system' and command == 'reboot':
+            return {'err_code': 0}
+        if target == 'emeter':
+            if command == 'get_realtime':
+                return copy.deepcopy(self.realtime)
+            if command == 'get_daystat':
+                days = [{'year': year, 'month': month, 'day': day, 'energy_wh': energy}
+                    for (year, month, day), energy in sorted(self.history.items())
+                    if (year, month) == (argument['year'], argument['month'])]
+                return {'day_list': days, 'err_code': 0}
+            if command == 'get_monthstat':
+                months = {}
+                for (year, month, _), energy in self.history.items():
+                    if year == argument['year']:
+                        months[month] = months.get(month, 0) + energy
+                return {'month_list': [{'year': argument['year'], 'month': month, 'energy_wh': energy}
+                    for month, energy in sorted(months.items())], 'err_code': 0}
+        return {'err_code': -2, 'err_msg': 'member not support'}
+
+    def Supports(self, target):
+        if target == 'emeter':
+            return 'ENE' in self.sysinfo.get('feature', '')
+        return target == 'system'
+
+    def Start(self):
+        for server in (self.server, self.udpServer):
+            thread = threading.Thread(target=server.serve_forever,
+                name='emulator-{}'.format(self.port), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def Stop(self):
+        for server in (self.server, self.udpServer):
+            if self.threads:
+                server.shutdown()
+            server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __CreateHandler(self):
+        emulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                while True:
+                    header = self.__ReadExactly(4)
+                    if header is None:
+                        return
+                    length = struct.unpack('>I', header)[0]
+                    payload = self.__ReadExactly(length)
+                    if payload is None:
+                        return
+                    request = json.loads(Device.Decrypt(payload, emulator.key))
+                    if emulator.latency > 0:
+                        time.sleep(emulator.latency)
+                    response = json.dumps(emulator.Handle(request))
+                    self.request.sendall(Device.Encrypt(response, emulator.key))
+
+            def __ReadExactly(self, size):
+                buffer = bytearray()
+                while len(buffer) < size:
+                    chunk = self.request.recv(size - len(buffer))
+                    if not chunk:
+                        return None
+                    buffer += chunk
+                return bytes(buffer)
+
+        return Handler
+
+    def __CreateDatagramHandler(self):
+        emulator = self
+
+        class DatagramHandler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                data, sock = self.request
+                try:
+                    request = json.loads(Device.Decrypt(data, emulator.key))
+                except (UnicodeDecodeError, ValueError):
+                    return
+                response = json.dumps(emulator.Handle(request))
+                sock.sendto(Device.Encrypt(response, emulator.key)[4:], self.client_address)
+
+        return DatagramHandler
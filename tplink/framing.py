@@ -0,0 +1,136 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import errno
+import socket
+import struct
+import time
+from . import cipher
+
+HEADER_SIZE = 4
+MAX_FRAME_SIZE = 1024 * 1024
+READ_SIZE = 16384
+
+
+class ConnectionClosedError(ConnectionResetError):
+    """
+    The connection was closed or reset before any byte of the response
+    arrived, which is how a device reports a persistent connection it
+    already dropped.
+    """
+
+
+class FrameReader(object):
+    """
+    Reads a single length prefixed frame from a socket. The payload buffer
+    is allocated once from the length header and filled in place with
+    recv_into. When a key is given each chunk is decrypted in place as it
+    arrives, so the buffer holds plaintext once the frame is complete.
+    """
+
+    def __init__(self, sock, key=None, maxSize=MAX_FRAME_SIZE, readTimeout=None,
+            deadline=None, clock=time.monotonic, latency=None):
+        """
+        :param sock: Connected socket.
+        :param key: Encryption key, or None to return the raw payload.
+        :param maxSize: Largest payload accepted in bytes.
+        :param readTimeout: Timeout for each read in seconds, defaults to
+            the timeout of the socket.
+        :param deadline: Monotonic time by which the whole frame must arrive.
+        :param clock: Monotonic clock.
+        :param latency: Optional LatencyStats receiving the time to first
+            byte, transfer and decryption times.
+        """
+        self.sock = sock
+        self.key = key
+        self.maxSize = maxSize
+        self.readTimeout = readTimeout
+        self.deadline = deadline
+        self.clock = clock
+        self.latency = latency
+        self.received = 0
+        self.firstByte = None
+        self.decryptTime = 0.0
+
+    def Read(self):
+        """
+        Read the frame.
+
+        :return: Payload as a bytearray, decrypted when a key was given.
+        """
+        start = time.perf_counter()
+        header = bytearray(HEADER_SIZE)
+        self.__Fill(memoryview(header))
+        length = struct.unpack('>I', header)[0]
+        if length > self.maxSize:
+            raise OSError(errno.EMSGSIZE,
+                'Frame of {} bytes exceeds the {} byte limit'.format(length, self.maxSize))
+
+        buffer = bytearray(length)
+        decryptor = cipher.Decryptor(self.key) if self.key is not None else None
+        self.__Fill(memoryview(buffer), decryptor)
+        if self.latency is not None:
+            self.latency.Record('ttfb', self.firstByte - start)
+            self.latency.Record('transfer',
+                time.perf_counter() - self.firstByte - self.decryptTime)
+            if decryptor is not None:
+                self.latency.Record('decrypt', self.decryptTime)
+        return buffer
+
+    def __Fill(self, view, decryptor=None):
+        offset = 0
+        while offset < len(view):
+            # Without a read timeout or deadline the socket keeps the
+            # timeout its owner configured.
+            timeout = self.__GetTimeout()
+            if timeout is not None:
+                self.sock.settimeout(timeout)
+            try:
+                count = self.sock.recv_into(view[offset:], min(len(view) - offset, READ_SIZE))
+            except ConnectionResetError as e:
+                if self.received == 0:
+                    raise ConnectionClosedError(errno.ECONNRESET,
+                        'Connection reset before the response') from e
+                raise
+            if count == 0:
+                if self.received == 0:
+                    raise ConnectionClosedError(errno.ECONNRESET,
+                        'Connection closed before the response')
+                raise OSError(errno.ECONNRESET, 'Connection closed mid-frame')
+            if self.firstByte is None:
+                self.firstByte = time.perf_counter()
+            if decryptor is not None:
+                chunk = view[offset:offset + count]
+                if self.latency is not None:
+                    start = time.perf_counter()
+                    chunk[:] = decryptor.Update(chunk)
+                    self.decryptTime += time.perf_counter() - start
+                else:
+                    chunk[:] = decryptor.Update(chunk)
+            offset += count
+            self.received += count
+
+    def __GetTimeout(self):
+        timeout = self.readTimeout
+        if self.deadline is not None:
+            remaining = self.deadline - self.clock()
+            if remaining <= 0:
+                raise socket.timeout(errno.ETIMEDOUT, 'Response deadline exceeded')
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+
+def ReadFrame(sock, key=None, **kwargs):
+    return FrameReader(sock, key=key, **kwargs).Read()
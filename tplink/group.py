@@ -0,0 +1,174 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from .exceptions import DeviceError
+import fnmatch
+import time
+
+
+class GroupResult(object):
+    """
+    Outcome of a group command on a single device.
+    """
+
+    def __init__(self, name, device, success, error=None, elapsed=0.0, value=None):
+        self.name = name
+        self.device = device
+        self.success = success
+        self.error = error
+        self.elapsed = elapsed
+        self.value = value
+        # Power state the device was switched to, when the command sets one.
+        self.state = None
+
+    def __repr__(self):
+        return '<GroupResult: {} {}>'.format(self.name, 'ok' if self.success else self.error)
+
+
+class DeviceGroup(object):
+    """
+    Set of devices controlled together. Commands are sent to every member
+    at the same time from a thread pool, so switching a group takes about
+    as long as its slowest device.
+    """
+
+    def __init__(self, concurrency=32, logger=None):
+        """
+        :param concurrency: Maximum number of devices commanded at once.
+        :param logger: Logger instance.
+        """
+        self.concurrency = max(1, int(concurrency))
+        self.logger = logger
+        self.members = []
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def Add(self, device, name=None, tags=None):
+        """
+        :param device: Device instance.
+        :param name: Name reported in the results, defaults to the address.
+        :param tags: Optional dictionary of tags used for selection.
+        """
+        self.members.append((name or device.address, device, dict(tags or {})))
+
+    def Dispatch(self, command):
+        """
+        Run a command on every member concurrently.
+
+        :param command: Callable receiving the device and returning the
+            device response, True or False.
+        :return: List of GroupResult in member order. The time the whole
+            group took is kept in elapsed.
+        """
+        start = time.perf_counter()
+
+        def Run(member):
+            name, device, _ = member
+            began = time.perf_counter()
+            try:
+                value = command(device)
+            except (DeviceError, ValueError) as e:
+                return GroupResult(name, device, False, error=getattr(e, 'message', str(e)),
+                    elapsed=time.perf_counter() - began)
+            error = None if IsSuccess(value) else 'Device rejected the command'
+            return GroupResult(name, device, error is None, error=error,
+                elapsed=time.perf_counter() - began, value=value)
+
+        if not self.members:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(self.members)),
+                thread_name_prefix='group') as executor:
+            results = list(executor.map(Run, self.members))
+        self.elapsed = time.perf_counter() - start
+        if self.logger:
+            self.logger.debug('Commanded {} devices in {:.1f}ms, {} failed'.format(
+                len(results), self.elapsed * 1000,
+                sum(1 for result in results if not result.success)))
+        return results
+
+    def Off(self):
+        return self.__SetState(self.Dispatch(lambda device: device.Off()), lambda device: False)
+
+    def On(self):
+        return self.__SetState(self.Dispatch(lambda device: device.On()), lambda device: True)
+
+    def Reboot(self, delay=1):
+        return self.Dispatch(lambda device: device.Reboot(delay))
+
+    def Select(self, tags=None, alias=None, type=None):
+        """
+        Build a group of the members matching every given filter.
+
+        :param tags: Dictionary of tags a member must carry.
+        :param alias: Case-insensitive shell-style pattern of the alias.
+        :param type: Device type such as 'plug', 'bulb' or 'lightstrip'.
+        :return: New DeviceGroup.
+        """
+        selected = DeviceGroup(self.concurrency, logger=self.logger)
+        for name, device, memberTags in self.members:
+            if tags and any(memberTags.get(key) != value for key, value in tags.items()):
+                continue
+            if type is not None and NormalizeType(device.GetType()) != NormalizeType(type):
+                continue
+            if alias is not None and not fnmatch.fnmatch(
+                    (device.GetAlias() or '').lower(), alias.lower()):
+                continue
+            selected.members.append((name, device, memberTags))
+        return selected
+
+    def SetBrightness(self, value):
+        def Command(device):
+            if not device.IsBrightnessSupported():
+                raise DeviceError('Brightness is not supported')
+            return device.SetBrightness(value)
+        return self.Dispatch(Command)
+
+    def Toggle(self):
+        states = {}
+
+        def Command(device):
+            states[device] = not device.IsOn()
+            return device.On() if states[device] else device.Off()
+        return self.__SetState(self.Dispatch(Command), states.get)
+
+    @staticmethod
+    def __SetState(results, state):
+        for result in results:
+            if result.success:
+                result.state = state(result.device)
+        return results
+
+
+def IsSuccess(response):
+    """
+    :param response: Device response or boolean result.
+    :return: False if the response is empty or any module reported an error.
+    """
+    if isinstance(response, bool):
+        return response
+    if not isinstance(response, dict) or not response:
+        return False
+    if response.get('err_code', 0) != 0:
+        return False
+    return all(IsSuccess(value) for value in response.values() if isinstance(value, dict))
+
+
+def NormalizeType(value):
+    return str(value).replace(' ', '').replace('_', '').lower()
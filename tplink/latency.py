@@ -0,0 +1,122 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import bisect
+import contextlib
+import threading
+import time
+
+# Bucket upper bounds in seconds. Anything slower lands in the overflow
+# bucket which only counts towards the total.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """
+    Fixed bucket latency histogram. Percentiles are estimated by linear
+    interpolation inside the bucket holding the requested rank.
+    """
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def Add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def Percentile(self, percent):
+        """
+        :param percent: Percentile between 0 and 100.
+        :return: Estimated value or None if the histogram is empty.
+        """
+        if self.count == 0:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            if seen + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def Snapshot(self):
+        """
+        :return: Dictionary of summary fields and cumulative bucket counts.
+        """
+        if self.count == 0:
+            return {'count': 0}
+        result = {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.Percentile(50),
+            'p90': self.Percentile(90),
+            'p99': self.Percentile(99),
+        }
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            result['le_{:g}'.format(bound)] = total
+        return result
+
+
+class LatencyStats(object):
+    """
+    Per-device latency histograms for each phase of a request: connect,
+    time to first byte, transfer of the rest of the frame, decryption and
+    JSON parsing.
+    """
+
+    PHASES = ('connect', 'ttfb', 'transfer', 'decrypt', 'parse')
+
+    def __init__(self, bounds=BUCKETS, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.histograms = {phase: Histogram(bounds) for phase in self.PHASES}
+
+    def Record(self, phase, seconds):
+        with self.lock:
+            self.histograms[phase].Add(seconds)
+
+    def Snapshot(self):
+        """
+        :return: Dictionary of phase to histogram snapshot for every phase
+            with at least one sample.
+        """
+        with self.lock:
+            return {phase: histogram.Snapshot()
+                for phase, histogram in self.histograms.items() if histogram.count}
+
+    @contextlib.contextmanager
+    def Time(self, phase):
+        # Failed operations are not recorded, they would only show up as
+        # the timeout value.
+        start = self.clock()
+        yield
+        self.Record(phase, self.clock() - start)
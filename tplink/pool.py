@@ -0,0 +1,210 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+import threading
+import time
+from .framing import ConnectionClosedError, ReadFrame
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent connections keyed by (address, port). Firmware which
+    keeps port 9999 open after a response can serve several framed requests
+    over one socket, saving a TCP handshake per request.
+
+    Idle connections are closed after the idle timeout and checked for a
+    remote close before reuse. A request on a reused connection is retried
+    once on a fresh connection when the device closed the connection before
+    the request was written or before any byte of the response arrived.
+    Timeouts and failures later in the response are not retried, since the
+    device may already have acted on a request such as a reboot.
+    """
+
+    def __init__(self, idleTimeout=30.0, maxIdle=2, clock=time.monotonic):
+        self.idleTimeout = float(idleTimeout)
+        self.maxIdle = int(maxIdle)
+        self.clock = clock
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.connectTime = 0.0
+        self.connectTimeMax = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Acquire(self, key, timeout, connectTimeout=None, latency=None):
+        """
+        Return a healthy connection for the key, reusing an idle one when
+        possible.
+
+        :param key: Tuple of (address, port).
+        :param timeout: Socket timeout in seconds.
+        :param connectTimeout: Connect timeout in seconds, defaults to timeout.
+        :param latency: Optional LatencyStats receiving the connect time.
+        :return: Tuple of (socket, reused).
+        """
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                if not connections:
+                    break
+                sock, released = connections.pop()
+            if self.clock() - released > self.idleTimeout or not self.IsHealthy(sock):
+                self.Discard(sock)
+                continue
+            sock.settimeout(timeout)
+            with self.lock:
+                self.reuses += 1
+            return sock, True
+        return self.Connect(key, timeout, connectTimeout, latency), False
+
+    def Close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock, _ in connections:
+                self.Discard(sock)
+
+    def Connect(self, key, timeout, connectTimeout=None, latency=None):
+        """
+        Open a new connection for the key, bypassing the idle connections.
+
+        :return: Connected socket.
+        """
+        start = self.clock()
+        sock = socket.create_connection(key, connectTimeout or timeout)
+        elapsed = self.clock() - start
+        sock.settimeout(timeout)
+        if latency is not None:
+            latency.Record('connect', elapsed)
+        with self.lock:
+            self.connects += 1
+            self.connectTime += elapsed
+            self.connectTimeMax = max(self.connectTimeMax, elapsed)
+        return sock
+
+    @staticmethod
+    def Discard(sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def IsHealthy(sock):
+        # An idle connection should never be readable. Readable means the
+        # device closed it (EOF) or sent unsolicited data, neither of which
+        # can be used for the next request. A non-blocking peek works for
+        # any descriptor, unlike select which is limited to FD_SETSIZE.
+        # Callers restore the socket timeout before using the connection.
+        try:
+            sock.setblocking(False)
+            sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def Prune(self):
+        """
+        Close every idle connection which exceeded the idle timeout.
+        """
+        now = self.clock()
+        expired = []
+        with self.lock:
+            for key, connections in self.idle.items():
+                keep = []
+                for sock, released in connections:
+                    if now - released > self.idleTimeout:
+                        expired.append(sock)
+                    else:
+                        keep.append((sock, released))
+                connections[:] = keep
+        for sock in expired:
+            self.Discard(sock)
+
+    def Release(self, key, sock):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxIdle:
+                connections.append((sock, self.clock()))
+                return
+        self.Discard(sock)
+
+    def Request(self, address, port, payload, timeout=3, read=ReadFrame,
+            connectTimeout=None, latency=None):
+        """
+        Send an encrypted request and return the response frame payload.
+
+        :param address: Device address.
+        :param port: Device port.
+        :param payload: Encrypted request including the length header.
+        :param timeout: Socket timeout in seconds.
+        :param read: Callable reading the response frame from the socket.
+        :param connectTimeout: Connect timeout in seconds, defaults to timeout.
+        :param latency: Optional LatencyStats receiving the connect time.
+        :return: Response frame payload as returned by read.
+        """
+        key = (address, int(port))
+        with self.lock:
+            self.requests += 1
+        sock, reused = self.Acquire(key, timeout, connectTimeout, latency)
+        try:
+            response = self.__Transact(sock, payload, read)
+        except OSError as e:
+            self.Discard(sock)
+            if not reused or not isinstance(e, ConnectionClosedError):
+                raise
+            with self.lock:
+                self.reconnects += 1
+            sock = self.Connect(key, timeout, connectTimeout, latency)
+            try:
+                response = self.__Transact(sock, payload, read)
+            except OSError:
+                self.Discard(sock)
+                raise
+        self.Release(key, sock)
+        return response
+
+    def Stats(self):
+        with self.lock:
+            idle = sum(len(connections) for connections in self.idle.values())
+            return {
+                'requests': self.requests,
+                'connects': self.connects,
+                'reuses': self.reuses,
+                'reconnects': self.reconnects,
+                'idle': idle,
+                'reuse_rate': float(self.reuses) / self.requests if self.requests else 0.0,
+                'connect_time_avg': self.connectTime / self.connects if self.connects else 0.0,
+                'connect_time_max': self.connectTimeMax,
+            }
+
+    @staticmethod
+    def __Transact(sock, payload, read):
+        try:
+            sock.sendall(payload)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise ConnectionClosedError(e.errno, 'Connection closed before the request') from e
+        return read(sock)
@@ -0,0 +1,222 @@
+# Copyright 2019-2024 Daniel Weiner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from array import array
+import base64
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity buffer of numbers backed by a preallocated array. Once
+    full, each append overwrites the oldest value.
+    """
+
+    def __init__(self, capacity, typecode='d'):
+        self.capacity = max(1, int(capacity))
+        self.data = array(typecode, [0]) * self.capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def Append(self, value):
+        index = (self.start + self.size) % self.capacity
+        self.data[index] = value
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def Values(self):
+        """
+        :return: Array of the values from oldest to newest.
+        """
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.data[self.start:end]
+        return self.data[self.start:] + self.data[:end - self.capacity]
+
+
+class TimeSeries(object):
+    """
+    Realtime readings of a single device in parallel ring buffers, one for
+    the timestamps and one per field. Missing values are stored as NaN.
+    """
+
+    FIELDS = ('current', 'voltage', 'power')
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.timestamps = RingBuffer(self.capacity)
+        self.fields = {field: RingBuffer(self.capacity) for field in self.FIELDS}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def Append(self, sample):
+        self.timestamps.Append(sample.timestamp)
+        for field, buffer in self.fields.items():
+            value = getattr(sample, field)
+            buffer.Append(math.nan if value is None else value)
+
+    def Summary(self, field, seconds, now=None):
+        """
+        Summarize a field over the most recent window.
+
+        :param field: Field name.
+        :param seconds: Window length in seconds.
+        :param now: End of the window as a UNIX timestamp, defaults to now.
+        :return: Dictionary of count, min, max, mean, p50, p90 and p99, or
+            None if the window holds no readings.
+        """
+        values = sorted(value for value in self.Window(field, seconds, now)
+            if not math.isnan(value))
+        if not values:
+            return None
+        return {
+            'count': len(values),
+            'min': values[0],
+            'max': values[-1],
+            'mean': math.fsum(values) / len(values),
+            'p50': Percentile(values, 50),
+            'p90': Percentile(values, 90),
+            'p99': Percentile(values, 99),
+        }
+
+    def Window(self, field, seconds, now=None):
+        """
+        :return: Array of the field values recorded in the last seconds.
+        """
+        now = time.time() if now is None else now
+        timestamps = self.timestamps.Values()
+        start = bisect.bisect_left(timestamps, now - seconds)
+        return self.fields[field].Values()[start:]
+
+
+class SeriesStore(object):
+    """
+    Time series of every polled device holding roughly the last number of
+    hours of readings. Buffer capacity is derived from the polling interval
+    of each device. The store can be saved to and loaded from a file so the
+    history survives restarts and can be read by other commands.
+    """
+
+    VERSION = 1
+
+    def __init__(self, hours):
+        self.hours = float(hours)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def Get(self, name):
+        with self.lock:
+            return self.series.get(name)
+
+    def Load(self, path):
+        """
+        Read a saved store. Buffers are resized to the current capacity on
+        the next reading of each device.
+
+        :return: True if the file was loaded.
+        """
+        try:
+            with open(path, 'r') as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return False
+        with self.lock:
+            for name, saved in data.get('devices', {}).items():
+                series = TimeSeries(saved['capacity'])
+                timestamps = Decode(saved['timestamps'])
+                fields = {field: Decode(saved[field]) for field in TimeSeries.FIELDS}
+                for index in range(len(timestamps)):
+                    series.timestamps.Append(timestamps[index])
+                    for field, buffer in series.fields.items():
+                        buffer.Append(fields[field][index])
+                self.series[name] = series
+        return True
+
+    def Names(self):
+        with self.lock:
+            return list(self.series)
+
+    def Record(self, name, sample, interval):
+        """
+        :param name: Device name.
+        :param sample: RealtimeSample to store.
+        :param interval: Shortest polling interval of the device in seconds.
+        """
+        capacity = int(math.ceil(self.hours * 3600.0 / max(interval, 1.0)))
+        with self.lock:
+            series = self.series.get(name)
+            if series is None or series.capacity != capacity:
+                series = self.__Resize(series, capacity)
+                self.series[name] = series
+            series.Append(sample)
+
+    def Save(self, path):
+        with self.lock:
+            data = {'version': self.VERSION, 'devices': {}}
+            for name, series in self.series.items():
+                saved = {'capacity': series.capacity,
+                    'timestamps': Encode(series.timestamps.Values())}
+                for field, buffer in series.fields.items():
+                    saved[field] = Encode(buffer.Values())
+                data['devices'][name] = saved
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w') as handle:
+            json.dump(data, handle)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def __Resize(series, capacity):
+        resized = TimeSeries(capacity)
+        if series is not None:
+            timestamps = series.timestamps.Values()
+            fields = {field: buffer.Values() for field, buffer in series.fields.items()}
+            for index in range(max(0, len(timestamps) - capacity), len(timestamps)):
+                resized.timestamps.Append(timestamps[index])
+                for field, buffer in resized.fields.items():
+                    buffer.Append(fields[field][index])
+        return resized
+
+
+def Decode(value):
+    return array('d', base64.b64decode(value))
+
+
+def Encode(values):
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def Percentile(values, percent):
+    """
+    :param values: Sorted list of values.
+    :param percent: Percentile between 0 and 100.
+    :return: Linearly interpolated percentile.
+    """
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
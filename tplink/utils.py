@@ -12,30 +12,129 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import time
+from collections import OrderedDict
 import re
 import socket
+import threading
+import time
 
 
 class Cache(object):
+    """
+    Time and size bounded cache. Entries expire after their TTL (seconds,
+    measured on a monotonic clock) and the least recently used entry is
+    evicted once the optional maximum size is reached. A single cache can
+    be shared between devices through namespaced views.
+    """
+
+    DEFAULT_TTL = 5.0
+    FOREVER = float('inf')
+
+    def __init__(self, ttl=DEFAULT_TTL, maxsize=None, clock=time.monotonic):
+        self.data = OrderedDict()
+        self.ttl = float(ttl)
+        self.maxsize = maxsize
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def Clear(self, namespace=None):
+        with self.lock:
+            if namespace is None:
+                self.data.clear()
+                return
+            for key in [key for key in self.data
+                    if isinstance(key, tuple) and key[0] == namespace]:
+                del self.data[key]
+
+    def Get(self, key, timeout=None):
+        """
+        Return the cached value or None if it is missing or expired.
+
+        :param key: Cache key.
+        :param timeout: Optional maximum age in seconds, applied on top of
+            the TTL the entry was inserted with.
+        :return: Cached value or None.
+        """
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (inserted, expiration, data) = entry
+            now = self.clock()
+            if now >= expiration or (timeout is not None and now - inserted > timeout):
+                del self.data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def Insert(self, key, data, ttl=None):
+        with self.lock:
+            now = self.clock()
+            ttl = self.ttl if ttl is None else float(ttl)
+            self.data[key] = (now, now + ttl, data)
+            self.data.move_to_end(key)
+            while self.maxsize is not None and len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def Invalidate(self, key):
+        with self.lock:
+            return self.data.pop(key, None) is not None
 
-    def __init__(self):
-        self.data = {}
+    def Stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def View(self, namespace):
+        return CacheView(self, namespace)
+
+
+class CacheView(object):
+    """
+    Namespaced view of a shared Cache. Keys are stored as (namespace, key)
+    and Clear only removes the entries belonging to the view.
+    """
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
 
     def Clear(self):
-        self.data.clear()
-
-    def Get(self, key, timeout=5):
-        if key not in self.data:
-            return None
-        (expiration, data) = self.data[key]
-        if time.time() > expiration + (timeout * 1000):
-            del self.data[key]
-            return None
-        return data
-
-    def Insert(self, key, data):
-        self.data[key] = (time.time(), data)
+        self.cache.Clear(self.namespace)
+
+    def Get(self, key, timeout=None):
+        return self.cache.Get((self.namespace, key), timeout=timeout)
+
+    def Insert(self, key, data, ttl=None):
+        self.cache.Insert((self.namespace, key), data, ttl=ttl)
+
+    def Invalidate(self, key):
+        return self.cache.Invalidate((self.namespace, key))
+
+    def Stats(self):
+        return self.cache.Stats()
+
+    def View(self, namespace):
+        return CacheView(self.cache, namespace)
 
 
 def IsValidIPv4(address):